@@ -7,8 +7,11 @@
 #
 ################################################################################
 
+from typing import Generator, List
+
 from rdp.services import ServiceBundle, OaipmhService, ZenodoRestService
-from rdp.util import Bundle
+from rdp.services.session import HttpSession
+from rdp.util import Bundle, LRUCache, prefetch
 
 class Rdp(object):
     """ Base class + interface for Research Data Products (RDP)
@@ -17,6 +20,9 @@ class Rdp(object):
     ----------
     pid : str
         Persistent Identifier of the RDP
+    session : HttpSession, optional
+        Pooled HTTP session shared by all services of the RDP (and possibly
+        by other RDPs)
 
     Attributes
     ----------
@@ -27,11 +33,11 @@ class Rdp(object):
     services: ServiceBundle
         All services offering access to the data or metadata of the RDP
     """
-    def __init__(self, pid):
+    def __init__(self, pid, session=None):
         self.pid = pid
         self._data = []
         self._metadata = Bundle()
-        self._services = ServiceBundle()
+        self._services = ServiceBundle(session=session)
 
     @property
     def data(self) -> Bundle:
@@ -47,6 +53,29 @@ class Rdp(object):
                 self._data.append(f)
         return self._data
 
+    def iter_data(self, window=0, maxWorkers=2, maxBytes=None) -> Generator:
+        """ Iterates over the data bundle. With a window > 0 the files of the
+            next window data objects are downloaded in the background while the
+            caller works on the current one.
+
+        Parameters
+        ----------
+        window: int, optional
+            Number of data objects to prefetch (0 disables prefetching)
+        maxWorkers: int, optional
+            Maximum number of concurrent downloads
+        maxBytes: int, optional
+            Maximum number of bytes prefetched ahead of the caller
+
+        Yields
+        ------
+        Data
+            Data objects of the RDP
+        """
+        if window < 1:
+            return iter(self.data)
+        return prefetch(self.data, window, maxWorkers, maxBytes)
+
     @property
     def metadata(self) -> Bundle:
         """ Getter for the metadata bundle (lazy loading via services)
@@ -78,6 +107,8 @@ class RdpFactory(object):
     -------
     create(pid, rdpType=None) -> Rdp
         Factory method returning an RDP appropriate for the given rdpType or a default RDP.
+    create_all(pids, rdpType=None) -> List[Rdp]
+        Factory method returning RDPs for many pids, sharing session and lookups
     """
     def create(pid, rdpType=None, **kwargs) -> Rdp:
         """Returns a fitting RDP given a type, a default otherwise
@@ -89,12 +120,39 @@ class RdpFactory(object):
         rdpType: str, optional
             A key indicating which RDP should be instantiated (supported: zenodo)
         kwargs: dict
-            Further optional arguments
+            Further optional arguments (supported: session, recordCache, store, textCache)
         """
+        session = kwargs.get("session", None)
         if rdpType == "zenodo":
-            return ZenodoRdp(pid)
+            return ZenodoRdp(pid, session, kwargs.get("recordCache", None),
+                             kwargs.get("store", None), kwargs.get("textCache", None))
         else:
-            return Rdp(pid)
+            return Rdp(pid, session)
+
+    def create_all(pids, rdpType=None, **kwargs) -> List[Rdp]:
+        """Returns fitting RDPs for many pids. All RDPs share one session; zenodo
+           RDPs also share one record cache, which is warmed with a few batch
+           requests.
+
+        Parameters
+        ----------
+        pids: list
+            Persistent Identifiers of the RDPs
+        rdpType: str, optional
+            A key indicating which RDP should be instantiated (supported: zenodo)
+        kwargs: dict
+            Further optional arguments (supported: session, recordCache, store, textCache)
+        """
+        session = kwargs.get("session", None) or HttpSession()
+        if rdpType != "zenodo":
+            return [Rdp(pid, session) for pid in pids]
+        recordCache = kwargs.get("recordCache", None) or LRUCache(max(1024, len(pids)), 3600)
+        rdps = [ZenodoRdp(pid, session, recordCache, kwargs.get("store", None),
+                          kwargs.get("textCache", None)) for pid in pids]
+        if len(rdps) > 0:
+            rdps[0].services.get("zenodo-rest-api").resolve_records(
+                [rdp.zenodo_id for rdp in rdps])
+        return rdps
 
 ################################################################################
 # SPECIFIC RDP IMPLEMENTATIONS
@@ -105,17 +163,20 @@ class ZenodoRdp(Rdp):
     Summary
     -------
     The ZenodoRDP is initiated with an OAI-PMH and an Zenodo REST-API service.
+    The record cache, the file store and the text cache of the latter can
+    be shared by several ZenodoRDPs (see RdpFactory.create_all).
 
     """
-    def __init__(self, pid):
-       super(ZenodoRdp, self).__init__(pid)
+    def __init__(self, pid, session=None, recordCache=None, store=None, textCache=None):
+       super(ZenodoRdp, self).__init__(pid, session)
        self.zenodo_id = self.pid.split(".")[-1]
        self.services.put(
            "oai-pmh",
            OaipmhService("https://zenodo.org/oai2d", "oai:zenodo.org:"))
        self.services.put(
            "zenodo-rest-api",
-           ZenodoRestService("https://zenodo.org/api")
+           ZenodoRestService("https://zenodo.org/api", recordCache=recordCache, store=store,
+                             textCache=textCache)
        )
 
     @property
@@ -7,16 +7,75 @@
 #
 ################################################################################
 import csv
+import hashlib
+import importlib.util
+import io
+import os
 import re
 import requests
+import shutil
+import subprocess
 import tempfile
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, islice, repeat
 from mimetypes import guess_type
+from typing import Dict, Generator, List, Tuple, Union
 from textract import process
-from textract.exceptions import ExtensionNotSupported
+from textract.parsers import EXTENSION_SYNONYMS
+from textract.exceptions import ExtensionNotSupported, ShellError
+from pdfminer.converter import TextConverter
+from pdfminer.layout import LAParams
+from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager
+from pdfminer.pdfpage import PDFPage
 from PyPDF2 import PdfFileReader
 
+from rdp.data.columns import build_columns
+from rdp.data.parsing import parse_csv
 from rdp.util import LazyFile
 
+def normalise_text(text) -> str:
+    """ Joins capital letters separated from the rest of their word (e.g. in
+        headings of extracted PDFs)
+    """
+    return re.sub(r"([A-Z]{1})\s+([A-Z]{5,})", r"\1\2", text)
+
+def extract_text(path) -> str:
+    """ Extracts the (normalised) text of a file
+
+    Parameters
+    ----------
+    path: str
+        Path of the file
+
+    Returns
+    -------
+    str
+        Text of the file (None if no text could be extracted)
+    """
+    try:
+        return normalise_text(process(path).decode("utf-8"))
+    except ExtensionNotSupported:
+        # textextract does not support this ending, so we consider it a textfile
+        return _read_text(lambda: open(path, "rb"))
+
+def _read_text(opener) -> str:
+    try:
+        with io.TextIOWrapper(opener()) as f:
+            return f.read()
+    except Exception:
+        return None
+
+def _textract_supports(name) -> bool:
+    """ True if textract has a parser for the file ending of name
+    """
+    extension = os.path.splitext(name)[1].lower()
+    extension = EXTENSION_SYNONYMS.get(extension, extension)
+    try:
+        return importlib.util.find_spec("textract.parsers{}_parser".format(extension)) is not None
+    except (ImportError, ValueError):
+        return False
+
 class Data(object):
     """ Base class and interface for Data as components of RDPs
 
@@ -39,42 +98,123 @@ class Data(object):
 ################################################################################
 class FileData(Data):
     """ Base class and fall back for Data based on files
+
+    Summary
+    -------
+    The extracted text is kept per object. If a TextCache is given, texts
+    are also cached on disk by the checksum of the file, so the text of the
+    same file is extracted only once across objects and runs (and, if the
+    checksum is known in advance, not even downloaded again).
+
+    Parameters
+    ----------
+    lazyFile: LazyFile
+        The file of the data item
+    textCache: TextCache, optional
+        On-disk cache of extracted texts
+
+    Attributes
+    ----------
+    digest: str
+        Verified checksum of the file (None if not downloaded or not verifiable)
+
+    Methods
+    -------
+    cached_text() -> Tuple[bool, str]
+        Text of the file if it is known without extraction
+    set_text(text) -> None
+        Keeps (and caches) the text extracted from the file
     """
-    def __init__(self, lazyFile):
+    def __init__(self, lazyFile, textCache=None):
         Data.__init__(self)
         self.file = lazyFile
+        self.textCache = textCache
+        self._text = None
+        self._textExtracted = False
+        # checksum computed from the content (if the file has none)
+        self._digest = None
         (self.type, self.encoding) = guess_type(self.file.source)
 
+    @property
+    def digest(self):
+        return self.file.digest
+
     @property
     def text(self):
-        try:
-            return re.sub(r"([A-Z]{1})\s+([A-Z]{5,})",
-                               r"\1\2",
-                               process(self.file.loc).decode("utf-8")
-                              )
-        except ExtensionNotSupported:
-            # textextract does not support this ending, so we consider it a textfile
-            try:
-                with open(self.file.loc, "r") as f:
-                    return f.read()
-            except Exception:
-                return None
+        (known, text) = self.cached_text()
+        if not known:
+            text = self._extract_text()
+            self.set_text(text)
+        return text
+
+    def cached_text(self) -> Tuple[bool, str]:
+        """ Text of the file if it is known without extraction (extracted
+            before or found in the text cache)
+
+        Returns
+        -------
+        Tuple[bool, str]
+            True and the text if it is known, False and None otherwise
+        """
+        if self._textExtracted:
+            return (True, self._text)
+        if self.textCache is None:
+            return (False, None)
+        text = self.textCache.get(self._checksum())
+        if text is None:
+            return (False, None)
+        self._text = text
+        self._textExtracted = True
+        return (True, text)
+
+    def set_text(self, text) -> None:
+        """ Keeps the text extracted from the file (and caches it if a text
+            cache is given)
+
+        Parameters
+        ----------
+        text: str
+            Text of the file (None if no text could be extracted)
+        """
+        self._text = text
+        self._textExtracted = True
+        if self.textCache is not None and text is not None:
+            self.textCache.put(self._checksum(), text)
+
+    def _checksum(self) -> str:
+        if self.file.checksum is not None:
+            return self.file.checksum
+        if self._digest is None:
+            sha = hashlib.sha256()
+            with self.file.open() as f:
+                for chunk in iter(lambda: f.read(1048576), b""):
+                    sha.update(chunk)
+            self._digest = "sha256:{}".format(sha.hexdigest())
+        return self._digest
+
+    def _extract_text(self):
+        if not _textract_supports(self.file.source.split("/")[-1]):
+            # read as text file, files held in memory are not written to disk
+            return _read_text(self.file.open)
+        return extract_text(self.file.loc)
 
 class FileDataFactory(object):
     """ Factory for FileData
 
     Methods
     -------
-    create(lazyFile: LazyFile) -> FileData
+    create(lazyFile: LazyFile, textCache=None) -> FileData
         Factory method returning a FileData object appropriate for the source
     """
-    def create(lazyFile: LazyFile) -> FileData:
+    def create(lazyFile: LazyFile, textCache=None) -> FileData:
         """ Creats a Data object appropriate for the specified source
 
         Parameters
         ----------
-        source: str
-            URI indicating where to find the data item
+        lazyFile: LazyFile
+            The file of the data item
+        textCache: TextCache, optional
+            On-disk cache of extracted texts
 
         Returns
         -------
@@ -83,10 +223,10 @@ class FileDataFactory(object):
 
         (ftype, encoding) = guess_type(lazyFile.source)
         if ftype == "text/csv":
-            return CSVData(lazyFile)
+            return CSVData(lazyFile, textCache=textCache)
         if ftype == "application/pdf":
-            return PDFData(lazyFile)
-        return FileData(lazyFile)
+            return PDFData(lazyFile, textCache)
+        return FileData(lazyFile, textCache)
 
 ################################################################################
 # SPECIFIC FILE-BASED DATA IMPLEMENTATIONS
@@ -100,39 +240,298 @@ class CSVData(FileData):
         List of column names of the csv (first row)
     rows: list of dicts
         List of key-value pairs for each row, keys are column headers
+        (materialises the whole file, use iter_rows for large files)
+    columns: Dict[str, Column]
+        Typed columns (int, float, date or string) keyed by column header
+    maxWorkers: int
+        If set, the file is split into chunks of chunkSize bytes which are
+        parsed by maxWorkers processes (results keep the order of the file),
+        for columns the workers also convert the values into typed buffers
+
+    Methods
+    -------
+    iter_rows(columns=None, skip=0, limit=None, asDict=True) -> Generator
+        Yields the rows one after another without keeping them in memory
+    statistics() -> Dict[str, Dict]
+        Minimum, maximum, mean and number of nulls of each column
     """
-    def __init__(self, lazyFile):
-        FileData.__init__(self, lazyFile)
-        self._header = []
-        self._rows = []
-
-    def _read_csv(self):
-        if len(self._header) == 0:
-            with open(self.file.loc, "r") as f:
-                reader = csv.reader(f, skipinitialspace=True)
-                self._header = next(reader)
-                self._rows = [dict(zip(self.header, row)) for row in reader]
+    def __init__(self, lazyFile, maxWorkers=None, chunkSize=67108864, textCache=None):
+        FileData.__init__(self, lazyFile, textCache)
+        self.maxWorkers = maxWorkers
+        self.chunkSize = chunkSize
+        self._header = None
+        self._rows = None
+        self._columns = None
+
+    @contextmanager
+    def _reader(self):
+        with io.TextIOWrapper(self.file.open(), newline="") as f:
+            yield csv.reader(f, skipinitialspace=True)
 
     @property
     def header(self):
-        self._read_csv()
+        if self._header is None:
+            with self._reader() as reader:
+                self._header = next(reader, [])
         return self._header
 
     @property
     def rows(self):
-        self._read_csv()
+        if self._rows is None:
+            self._rows = list(self.iter_rows())
         return self._rows
 
+    @property
+    def columns(self):
+        if self._columns is None:
+            self._columns = build_columns(self.header, self._column_batches)
+        return self._columns
+
+    def _column_batches(self, types, batchSize=65536) -> Generator[List, None, None]:
+        width = len(self.header)
+        if self.maxWorkers is not None:
+            # the chunks are converted into typed columns by the workers
+            yield from parse_csv(self.file.loc, self.maxWorkers, self.chunkSize,
+                                 list(range(width)), columnar=True, types=types)
+            return
+        with self._reader() as reader:
+            next(reader, None)
+            while True:
+                batch = list(islice(reader, batchSize))
+                if len(batch) == 0:
+                    return
+                batch = [r if len(r) == width else (r + [""] * width)[:width] for r in batch]
+                yield list(zip(*batch))
+
+    def statistics(self) -> Dict[str, Dict]:
+        """ Minimum, maximum, mean (numeric columns only) and number of nulls
+            of each column
+
+        Returns
+        -------
+        Dict[str, Dict]
+            Statistics keyed by column header
+        """
+        return {name: column.statistics() for (name, column) in self.columns.items()}
+
+    def iter_rows(self, columns=None, skip=0, limit=None, asDict=True) -> Generator[Union[Dict, Tuple], None, None]:
+        """ Yields the rows of the csv one after another (memory stays constant)
+
+        Parameters
+        ----------
+        columns: list of str, optional
+            Names of the columns to be yielded (in this order), all if None
+        skip: int, optional
+            Number of rows (after the header) to be skipped
+        limit: int, optional
+            Maximum number of rows to be yielded
+        asDict: bool, optional
+            If True, rows are dicts keyed by column name, otherwise tuples
+
+        Yields
+        ------
+        Union[Dict, Tuple]
+            The (projected) rows
+        """
+        header = self.header
+        if columns is None:
+            names = header
+            indices = None
+        else:
+            names = list(columns)
+            missing = [c for c in names if c not in header]
+            if missing:
+                raise KeyError("Unknown columns: {}".format(", ".join(missing)))
+            indices = [header.index(c) for c in names]
+        stop = None if limit is None else skip + limit
+        if self.maxWorkers is None:
+            with self._reader() as reader:
+                next(reader, None)
+                for row in islice(reader, skip, stop):
+                    if indices is not None:
+                        row = [row[i] if i < len(row) else None for i in indices]
+                    yield dict(zip(names, row)) if asDict else tuple(row)
+        else:
+            chunks = parse_csv(self.file.loc, self.maxWorkers, self.chunkSize, indices)
+            try:
+                for row in islice(chain.from_iterable(chunks), skip, stop):
+                    yield dict(zip(names, row)) if asDict else tuple(row)
+            finally:
+                chunks.close()
+
 class PDFData(FileData):
     """ Portable Document File Data
 
+    Summary
+    -------
+    Nothing is downloaded or opened on construction. The file is opened on
+    first access to numPages (or text) and closed right afterwards.
+
+    Parameters
+    ----------
+    lazyFile: LazyFile
+        The file of the data item
+    textCache: TextCache, optional
+        On-disk cache of extracted texts
+    maxWorkers: int, optional
+        If set, text is extracted by up to maxWorkers processes, each working
+        on a range of pages (see extract_pages), and normalised as a whole
+        like the text extracted sequentially
+
+    Attributes
+    ----------
     numPages: int
         Number of pages
+
+    Methods
+    -------
+    iter_pages(start=0, stop=None) -> Generator[str, None, None]
+        Yields the text of the PDF page by page
+    extract_pages(maxWorkers=None, pagesPerRange=None) -> List[str]
+        Text of all pages, extracted by several processes
     """
-    def __init__(self, lazyFile):
-        FileData.__init__(self, lazyFile)
-        self.pdf = PdfFileReader(open(self.file.loc, "rb"))
+    def __init__(self, lazyFile, textCache=None, maxWorkers=None):
+        FileData.__init__(self, lazyFile, textCache)
+        self.maxWorkers = maxWorkers
+        self._numPages = None
+
+    @contextmanager
+    def _reader(self):
+        with self.file.open() as f:
+            yield PdfFileReader(f)
 
     @property
     def numPages(self):
-        return self.pdf.getNumPages()
+        if self._numPages is None:
+            with self._reader() as pdf:
+                self._numPages = pdf.getNumPages()
+        return self._numPages
+
+    def _extract_text(self):
+        if self.maxWorkers is None:
+            return FileData._extract_text(self)
+        # normalised as a whole like the sequential text (not page by page)
+        pages = self._extract_ranges(self.maxWorkers, None, False)
+        return normalise_text("".join("{}\f".format(page) for page in pages))
+
+    def iter_pages(self, start=0, stop=None) -> Generator[str, None, None]:
+        """ Yields the (normalised) text of the PDF page by page, so only one
+            page is held in memory at a time
+
+        Summary
+        -------
+        Like text, pdftotext is used if installed (its output is streamed and
+        split at form feeds), pdfminer otherwise. The normalisation is applied
+        per page, so words are not joined across page breaks. text may join a
+        capital letter at the end of one page with a capitalised word at the
+        start of the next one, so the pages joined by form feeds can differ
+        from text in such cases.
+
+        Parameters
+        ----------
+        start: int, optional
+            Index of the first page (starting with 0)
+        stop: int, optional
+            Index after the last page (last page of the document if None)
+
+        Yields
+        ------
+        str
+            Text of each page
+
+        Raises
+        ------
+        ShellError
+            If pdftotext fails (after the pages it could extract)
+        """
+        if stop is not None and stop <= start:
+            return
+        if shutil.which("pdftotext") is not None:
+            pages = _pdftotext_pages(self.file.loc, start, stop)
+        else:
+            pages = _pdfminer_pages(self.file.open, start, stop)
+        for page in pages:
+            yield normalise_text(page)
+
+    def extract_pages(self, maxWorkers=None, pagesPerRange=None) -> List[str]:
+        """ Text of all pages, extracted by worker processes each working on a
+            range of pages (pages are returned in the order of the document)
+
+        Parameters
+        ----------
+        maxWorkers: int, optional
+            Number of worker processes (number of CPUs if None)
+        pagesPerRange: int, optional
+            Number of pages per range (by default numPages is split into four
+            ranges per worker to balance the load)
+
+        Returns
+        -------
+        List[str]
+            Text of each page
+        """
+        return self._extract_ranges(maxWorkers, pagesPerRange, True)
+
+    def _extract_ranges(self, maxWorkers, pagesPerRange, normalise) -> List[str]:
+        maxWorkers = maxWorkers or os.cpu_count() or 1
+        numPages = self.numPages
+        if pagesPerRange is None:
+            pagesPerRange = max(1, -(-numPages // (4 * maxWorkers)))
+        starts = list(range(0, numPages, pagesPerRange))
+        stops = [min(start + pagesPerRange, numPages) for start in starts]
+        path = self.file.loc
+        with ProcessPoolExecutor(max_workers=maxWorkers) as executor:
+            return list(chain.from_iterable(
+                executor.map(_page_texts, repeat(path), starts, stops, repeat(normalise))))
+
+def _pdftotext_pages(path, start, stop) -> Generator[str, None, None]:
+    args = ["pdftotext", "-enc", "UTF-8", "-f", str(start + 1)]
+    if stop is not None:
+        args += ["-l", str(stop)]
+    args += [path, "-"]
+    # a file instead of a pipe, so stderr cannot block the process
+    errors = tempfile.TemporaryFile()
+    proc = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=errors)
+    try:
+        buffer = b""
+        for chunk in iter(lambda: proc.stdout.read1(65536), b""):
+            pages = (buffer + chunk).split(b"\f")
+            buffer = pages.pop()
+            for page in pages:
+                yield page.decode("utf-8")
+        if proc.wait() != 0:
+            errors.seek(0)
+            raise ShellError(" ".join(args), proc.returncode, "",
+                             errors.read().decode("utf-8", "replace"))
+        if buffer.strip():
+            yield buffer.decode("utf-8")
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+        proc.stdout.close()
+        proc.wait()
+        errors.close()
+
+def _pdfminer_pages(opener, start, stop) -> Generator[str, None, None]:
+    resources = PDFResourceManager()
+    out = io.StringIO()
+    device = TextConverter(resources, out, laparams=LAParams())
+    interpreter = PDFPageInterpreter(resources, device)
+    try:
+        with opener() as f:
+            for page in islice(PDFPage.get_pages(f), start, stop):
+                interpreter.process_page(page)
+                yield out.getvalue().rstrip("\f")
+                out.seek(0)
+                out.truncate()
+    finally:
+        device.close()
+
+def _page_texts(path, start, stop, normalise=True) -> List[str]:
+    """ (Normalised) text of the pages start to stop (run in worker processes)
+    """
+    if shutil.which("pdftotext") is not None:
+        pages = _pdftotext_pages(path, start, stop)
+    else:
+        pages = _pdfminer_pages(lambda: open(path, "rb"), start, stop)
+    return [normalise_text(page) for page in pages] if normalise else list(pages)
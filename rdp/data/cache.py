@@ -0,0 +1,64 @@
+################################################################################
+# Copyright: Tobias Weber 2020
+#
+# Apache 2.0 License
+#
+# This file contains all code related to caching extracted texts of data
+#
+################################################################################
+import hashlib
+import os
+import uuid
+
+from textract import VERSION as TEXTRACT_VERSION
+
+# to be increased whenever the extraction or normalisation of texts changes
+EXTRACTOR_VERSION = "1"
+
+class TextCache(object):
+    """ On-disk cache of extracted texts keyed by the checksum of the file and
+        the version of the extractor, shared by all Data objects (and
+        processes) using the same directory
+
+    Parameters
+    ----------
+    directory: str
+        Directory of the cache (created if missing)
+    version: str, optional
+        Version of the extractor, texts of other versions are not used
+
+    Methods
+    -------
+    get(checksum) -> str
+        Cached text of the file with the given checksum (None if not cached)
+    put(checksum, text) -> None
+        Caches the text of the file with the given checksum
+    """
+    def __init__(self, directory, version=None):
+        self.directory = directory
+        self.version = version or "{}-{}".format(EXTRACTOR_VERSION, TEXTRACT_VERSION)
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, checksum) -> str:
+        """ Path of the cached text of the file with the given checksum
+        """
+        key = hashlib.sha256("{}|{}".format(checksum, self.version).encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, "{}.txt".format(key))
+
+    def get(self, checksum) -> str:
+        """ Cached text of the file with the given checksum (None if not cached)
+        """
+        try:
+            with open(self.path(checksum), "r", encoding="utf-8") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, checksum, text) -> None:
+        """ Caches the text of the file with the given checksum
+        """
+        path = self.path(checksum)
+        tmp = "{}.{}.tmp".format(path, uuid.uuid4().hex)
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp, path)
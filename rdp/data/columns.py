@@ -0,0 +1,427 @@
+################################################################################
+# Copyright: Tobias Weber 2020
+#
+# Apache 2.0 License
+#
+# This file contains all code related to typed columns of tabular data
+#
+################################################################################
+import math
+import warnings
+from array import array
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Iterable, List, Sequence
+
+try:
+    import numpy
+except ImportError:
+    # numpy is optional, columns fall back to array buffers and plain lists
+    numpy = None
+
+INT = "int"
+FLOAT = "float"
+DATE = "date"
+STRING = "string"
+
+NULLS = frozenset(["", "NA", "N/A", "NaN", "nan", "null", "NULL", "None"])
+
+TYPES = [INT, FLOAT, DATE, STRING]
+
+# numpy's NaT, marks null dates in date buffers
+_NAT = -2 ** 63
+_EPOCH = datetime(1970, 1, 1)
+
+_INT64 = (-2 ** 63, 2 ** 63 - 1)
+
+def _int64(value) -> int:
+    number = int(value)
+    if not _INT64[0] <= number <= _INT64[1]:
+        raise OverflowError("{} does not fit into int64".format(value))
+    return number
+
+_PARSERS = (
+    (INT, _int64),
+    (FLOAT, float),
+    (DATE, datetime.fromisoformat),
+)
+
+def infer_type(values) -> str:
+    """ Infers the narrowest type (int, float, date, string) of string values
+
+    Parameters
+    ----------
+    values: Iterable[str]
+        Values to be inspected (nulls are ignored)
+
+    Returns
+    -------
+    str
+        One of INT, FLOAT, DATE or STRING
+    """
+    candidate = 0
+    numeric = False
+    for value in values:
+        if value in NULLS:
+            continue
+        while candidate < len(_PARSERS):
+            if _PARSERS[candidate][0] == DATE and numeric:
+                # numbers cannot be turned into dates
+                return STRING
+            try:
+                _PARSERS[candidate][1](value)
+                break
+            except (ValueError, OverflowError):
+                candidate += 1
+        if candidate == len(_PARSERS):
+            return STRING
+        numeric = numeric or _PARSERS[candidate][0] in (INT, FLOAT)
+    return _PARSERS[candidate][0] if candidate < len(_PARSERS) else STRING
+
+class Column(object):
+    """ Typed column of tabular data
+
+    Summary
+    -------
+    Numeric columns are held in numpy arrays (int64, float64) if numpy is
+    installed, otherwise in array buffers ("q", "d"). Dates are held in a
+    datetime64[us] array (or a list of naive UTC datetimes), strings in a
+    list. Nulls are nan (float), NaT (numpy dates) or None; int columns
+    containing nulls become float columns.
+
+    Parameters
+    ----------
+    name: str
+        Name of the column
+    dtype: str
+        One of INT, FLOAT, DATE or STRING
+    values: Union[numpy.ndarray, array, list]
+        Typed values of the column
+    nulls: int
+        Number of null values
+
+    Methods
+    -------
+    statistics() -> Dict
+        Minimum, maximum, mean (numeric columns only) and number of nulls
+    """
+    def __init__(self, name, dtype, values, nulls=0):
+        self.name = name
+        self.dtype = dtype
+        self.values = values
+        self.nulls = nulls
+
+    def __len__(self):
+        return len(self.values)
+
+    def _valid(self):
+        if self.dtype == FLOAT:
+            return [v for v in self.values if not math.isnan(v)]
+        return [v for v in self.values if v is not None]
+
+    def statistics(self) -> Dict:
+        """ Minimum, maximum, mean (None for non-numeric columns) and number of nulls
+        """
+        stats = {"min": None, "max": None, "mean": None, "nulls": self.nulls}
+        if len(self.values) == self.nulls:
+            return stats
+        if numpy is not None and self.dtype in (INT, FLOAT):
+            stats["min"] = numpy.nanmin(self.values).item()
+            stats["max"] = numpy.nanmax(self.values).item()
+            stats["mean"] = numpy.nanmean(self.values).item()
+        elif numpy is not None and self.dtype == DATE:
+            valid = self.values[~numpy.isnat(self.values)]
+            stats["min"] = valid.min().item()
+            stats["max"] = valid.max().item()
+        else:
+            valid = self._valid()
+            stats["min"] = min(valid)
+            stats["max"] = max(valid)
+            if self.dtype in (INT, FLOAT):
+                stats["mean"] = math.fsum(valid) / len(valid)
+        return stats
+
+def _widen(dtype, value) -> str:
+    """ Narrowest type wider than dtype which can hold value
+    """
+    if value in NULLS:
+        return FLOAT if dtype == INT else dtype
+    parsers = dict(_PARSERS)
+    for candidate in TYPES[TYPES.index(dtype) + 1:]:
+        if candidate == DATE and dtype in (INT, FLOAT):
+            # numbers cannot be turned into dates
+            continue
+        if candidate == STRING:
+            return STRING
+        try:
+            parsers[candidate](value)
+            return candidate
+        except (ValueError, OverflowError):
+            continue
+    return STRING
+
+def _wider(dtype, other) -> str:
+    """ Narrowest type which can hold values of both types
+    """
+    if dtype == other:
+        return dtype
+    if DATE in (dtype, other) and (INT in (dtype, other) or FLOAT in (dtype, other)):
+        return STRING
+    return TYPES[max(TYPES.index(dtype), TYPES.index(other))]
+
+def _microseconds(value) -> int:
+    date = datetime.fromisoformat(value)
+    if date.tzinfo is not None:
+        date = date.astimezone(timezone.utc).replace(tzinfo=None)
+    return (date - _EPOCH) // timedelta(microseconds=1)
+
+class WidenColumn(Exception):
+    """ Raised by a ColumnBuilder if a value does not fit the column type and
+        the values already added cannot be converted in place
+
+    Attributes
+    ----------
+    dtype: str
+        Type the column has to be rebuilt with
+    """
+    def __init__(self, dtype):
+        Exception.__init__(self, "column has to be rebuilt as {}".format(dtype))
+        self.dtype = dtype
+
+class ColumnBuilder(object):
+    """ Builds a typed column batch by batch, converting each batch of string
+        values right away into a compact buffer (array "q" for ints and dates,
+        array "d" for floats)
+
+    Summary
+    -------
+    An int column receiving nulls or floats (or merged with a float builder)
+    is widened in place. Any other value not fitting the type raises
+    WidenColumn, the column then has to be rebuilt from the start with the
+    wider type.
+
+    Parameters
+    ----------
+    name: str
+        Name of the column
+    dtype: str
+        One of INT, FLOAT, DATE or STRING
+
+    Methods
+    -------
+    extend(values) -> None
+        Converts and appends a batch of string values
+    merge(other: ColumnBuilder) -> None
+        Appends the values of another builder
+    build() -> Column
+        The typed column (backed by numpy arrays if numpy is installed)
+    """
+    def __init__(self, name, dtype):
+        self.name = name
+        self.dtype = dtype
+        self.nulls = 0
+        self._values = array("q") if dtype in (INT, DATE) else \
+            array("d") if dtype == FLOAT else []
+
+    def extend(self, values) -> None:
+        """ Converts and appends a batch of string values
+        """
+        if self.dtype == INT:
+            try:
+                self._values.extend(array("q", map(int, values)))
+                return
+            except (ValueError, OverflowError):
+                dtype = self._failing(_int64, values)
+                if dtype != FLOAT:
+                    raise WidenColumn(dtype)
+                self._to_float()
+        if self.dtype == FLOAT:
+            try:
+                batch = array("d", map(float, values))
+            except ValueError:
+                batch = array("d")
+                for value in values:
+                    if value in NULLS:
+                        batch.append(math.nan)
+                    else:
+                        try:
+                            batch.append(float(value))
+                        except ValueError:
+                            raise WidenColumn(_widen(FLOAT, value))
+            self._values.extend(batch)
+        elif self.dtype == DATE:
+            if numpy is not None:
+                try:
+                    nulls = [v in NULLS for v in values]
+                    with warnings.catch_warnings():
+                        # numpy only warns about time zones
+                        warnings.simplefilter("error")
+                        dates = numpy.array(["NaT" if n else v for (n, v) in zip(nulls, values)],
+                                            dtype="datetime64[us]")
+                    self._values.frombytes(dates.view(numpy.int64).tobytes())
+                    self.nulls += sum(nulls)
+                    return
+                except (ValueError, Warning):
+                    # e.g. dates with time zones, converted one by one
+                    pass
+            batch = array("q")
+            for value in values:
+                if value in NULLS:
+                    batch.append(_NAT)
+                    self.nulls += 1
+                else:
+                    try:
+                        batch.append(_microseconds(value))
+                    except (ValueError, OverflowError):
+                        raise WidenColumn(_widen(DATE, value))
+            self._values.extend(batch)
+        elif self.dtype == STRING:
+            batch = [None if v in NULLS else v for v in values]
+            self.nulls += len(batch) - sum(1 for v in batch if v is not None)
+            self._values.extend(batch)
+
+    def merge(self, other) -> None:
+        """ Appends the values of another builder (e.g. of a chunk converted
+            in a worker process)
+        """
+        values = other._values
+        if other.dtype != self.dtype:
+            if {self.dtype, other.dtype} != {INT, FLOAT}:
+                raise WidenColumn(_wider(self.dtype, other.dtype))
+            if self.dtype == INT:
+                self._to_float()
+            else:
+                values = array("d", values)
+        self._values.extend(values)
+        self.nulls += other.nulls
+
+    def _to_float(self) -> None:
+        self.dtype = FLOAT
+        self._values = array("d", self._values)
+
+    def _failing(self, parser, values) -> str:
+        for value in values:
+            try:
+                parser(value)
+            except (ValueError, OverflowError):
+                return _widen(self.dtype, value)
+        return self.dtype
+
+    def build(self) -> Column:
+        """ The typed column (backed by numpy arrays if numpy is installed)
+        """
+        values = self._values
+        nulls = self.nulls
+        if self.dtype == FLOAT:
+            nulls = sum(1 for v in values if v != v)
+        if numpy is not None and self.dtype != STRING:
+            dtype = numpy.float64 if self.dtype == FLOAT else numpy.int64
+            values = numpy.frombuffer(values, dtype=dtype) if len(values) > 0 \
+                else numpy.array([], dtype=dtype)
+            if self.dtype == DATE:
+                values = values.view("datetime64[us]")
+        elif self.dtype == DATE:
+            values = [None if v == _NAT else _EPOCH + timedelta(microseconds=v) for v in values]
+        return Column(self.name, self.dtype, values, nulls)
+
+def convert_values(name, values: Sequence[str], dtype=None, sample=1000) -> ColumnBuilder:
+    """ Converts string values into a builder, the type (inferred from the
+        first sample values if None) is widened until all values fit
+
+    Parameters
+    ----------
+    name: str
+        Name of the column
+    values: Sequence[str]
+        Raw values of the column
+    dtype: str, optional
+        One of INT, FLOAT, DATE or STRING
+    sample: int, optional
+        Number of values used for type inference
+
+    Returns
+    -------
+    ColumnBuilder
+    """
+    dtype = dtype or infer_type(values[:sample])
+    while True:
+        builder = ColumnBuilder(name, dtype)
+        try:
+            builder.extend(values)
+            return builder
+        except WidenColumn as e:
+            dtype = e.dtype
+
+def build_columns(names, batches: Callable[[List[str]], Iterable[List]],
+                  sample=1000) -> Dict[str, Column]:
+    """ Builds typed columns from batches of string values (or of builders
+        converted elsewhere). The types are inferred from the first sample
+        values of the first batch, a column whose type turns out to be too
+        narrow is rebuilt (which needs another pass over the batches).
+
+    Parameters
+    ----------
+    names: List[str]
+        Names of the columns
+    batches: Callable
+        Returns an iterator over the batches given the types known so far
+        (None on the first call), each batch is a list holding a sequence
+        of string values (or a ColumnBuilder) per column
+    sample: int, optional
+        Number of values used for type inference
+
+    Returns
+    -------
+    Dict[str, Column]
+        Columns keyed by name
+    """
+    types = None
+    while True:
+        builders = None
+        rebuild = False
+        iterator = batches(types)
+        try:
+            for batch in iterator:
+                if builders is None:
+                    if types is None:
+                        types = [values.dtype if isinstance(values, ColumnBuilder)
+                                 else infer_type(values[:sample]) for values in batch]
+                    builders = [ColumnBuilder(n, t) for (n, t) in zip(names, types)]
+                for (i, values) in enumerate(batch[:len(builders)]):
+                    try:
+                        if isinstance(values, ColumnBuilder):
+                            builders[i].merge(values)
+                        else:
+                            builders[i].extend(values)
+                    except WidenColumn as e:
+                        types[i] = e.dtype
+                        rebuild = True
+                        break
+                if rebuild:
+                    break
+        finally:
+            if hasattr(iterator, "close"):
+                iterator.close()
+        if not rebuild:
+            break
+    if builders is None:
+        builders = [ColumnBuilder(n, infer_type([])) for n in names]
+    return {builder.name: builder.build() for builder in builders}
+
+def create_column(name, values: List[str], sample=1000) -> Column:
+    """ Creates a column from string values, the type is inferred from the
+        first sample values (and widened if later values do not fit)
+
+    Parameters
+    ----------
+    name: str
+        Name of the column
+    values: List[str]
+        Raw values of the column
+    sample: int, optional
+        Number of values used for type inference
+
+    Returns
+    -------
+    Column
+    """
+    return convert_values(name, values, sample=sample).build()
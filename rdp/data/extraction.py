@@ -0,0 +1,159 @@
+################################################################################
+# Copyright: Tobias Weber 2020
+#
+# Apache 2.0 License
+#
+# This file contains all code related to batch text extraction of data
+#
+################################################################################
+import multiprocessing
+import os
+import signal
+import time
+from multiprocessing.connection import wait
+from typing import Generator, Iterable, Tuple, Union
+
+from rdp.data import Data, FileData, extract_text
+from rdp.util import prefetch
+
+def _worker(connection, path) -> None:
+    if hasattr(os, "setsid"):
+        # own process group, so subprocesses (e.g. pdftotext) can be killed
+        # together with the worker
+        os.setsid()
+    try:
+        result = extract_text(path)
+    except Exception as e:
+        result = e
+    try:
+        connection.send(result)
+    except Exception:
+        # exceptions which cannot be pickled
+        connection.send(RuntimeError(repr(result)))
+    finally:
+        connection.close()
+
+def _kill(process) -> None:
+    """ Kills a worker together with the processes it started
+    """
+    if hasattr(os, "killpg"):
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            # the worker has not created its process group yet (or is gone)
+            pass
+    process.kill()
+    process.join()
+
+def _flatten(items) -> Generator[Data, None, None]:
+    if isinstance(items, Data):
+        yield items
+    elif isinstance(items, (str, bytes)):
+        # iterating strings would never end (each character is a string)
+        raise TypeError("Expected data objects, RDPs or iterables of them, got {!r}".format(
+            items))
+    elif hasattr(items, "data"):
+        # an RDP
+        yield from items.data
+    else:
+        for item in items:
+            yield from _flatten(item)
+
+def _known_text(data) -> Tuple[bool, Union[str, Exception]]:
+    """ Text of data if it can be obtained without extraction
+    """
+    if not isinstance(data, FileData):
+        try:
+            return (True, data.text)
+        except Exception as e:
+            return (True, e)
+    return data.cached_text()
+
+def extract_texts(items: Iterable, maxWorkers=None, timeout=None,
+                  window=None) -> Generator[Tuple[Data, Union[str, Exception]], None, None]:
+    """ Extracts the texts of many data objects in worker processes and yields
+        them as soon as they are available
+
+    Summary
+    -------
+    Files are downloaded in the background (at most window ahead of the
+    extraction) and each extraction runs in a process of its own, so an
+    extraction exceeding the timeout can be killed (together with the
+    processes it started) without stalling the batch. Extracted texts are kept by the data objects (and their text
+    caches, if any), failed extractions are yielded as exceptions.
+
+    Parameters
+    ----------
+    items: Iterable
+        Data objects, RDPs, or (nested) iterables of them
+    maxWorkers: int, optional
+        Maximum number of concurrent extractions (number of CPUs if None)
+    timeout: float, optional
+        Maximum time (in seconds) for the extraction of one file
+    window: int, optional
+        Number of files downloaded ahead of the extraction (maxWorkers if None)
+
+    Yields
+    ------
+    Tuple[Data, Union[str, Exception]]
+        Data object and its text (or the exception raised while extracting it,
+        TimeoutError if the extraction took too long)
+    """
+    maxWorkers = maxWorkers or os.cpu_count() or 1
+    window = maxWorkers if window is None else window
+    context = multiprocessing.get_context()
+    source = prefetch(_flatten(items), window)
+    running = {}
+    exhausted = False
+    try:
+        while True:
+            while not exhausted and len(running) < maxWorkers:
+                data = next(source, None)
+                if data is None:
+                    exhausted = True
+                    break
+                try:
+                    (known, text) = _known_text(data)
+                    path = None if known else data.file.loc
+                except Exception as e:
+                    (known, text) = (True, e)
+                if known:
+                    yield (data, text)
+                    continue
+                (receiver, sender) = context.Pipe(duplex=False)
+                process = context.Process(target=_worker, args=(sender, path), daemon=True)
+                process.start()
+                sender.close()
+                deadline = None if timeout is None else time.monotonic() + timeout
+                running[receiver] = (data, process, deadline)
+            if len(running) == 0:
+                return
+            deadlines = [entry[2] for entry in running.values() if entry[2] is not None]
+            remaining = max(0.0, min(deadlines) - time.monotonic()) if deadlines else None
+            ready = wait(list(running), remaining)
+            now = time.monotonic()
+            for receiver in list(running):
+                (data, process, deadline) = running[receiver]
+                if receiver in ready:
+                    try:
+                        text = receiver.recv()
+                    except EOFError:
+                        text = RuntimeError("Worker extracting {} died (exit code {})".format(
+                            data.file.source, process.exitcode))
+                    process.join()
+                elif deadline is not None and now >= deadline:
+                    _kill(process)
+                    text = TimeoutError("Extracting {} took more than {} seconds".format(
+                        data.file.source, timeout))
+                else:
+                    continue
+                receiver.close()
+                del running[receiver]
+                if not isinstance(text, Exception):
+                    data.set_text(text)
+                yield (data, text)
+    finally:
+        for (receiver, (data, process, deadline)) in running.items():
+            _kill(process)
+            receiver.close()
+        source.close()
@@ -0,0 +1,223 @@
+################################################################################
+# Copyright: Tobias Weber 2020
+#
+# Apache 2.0 License
+#
+# This file contains all code related to parallel parsing of csv files
+#
+################################################################################
+import csv
+import io
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Generator, List, Tuple, Union
+
+from rdp.data.columns import ColumnBuilder, convert_values
+
+# size of the blocks read while looking for a record boundary
+_WINDOW = 65536
+_FIELD_ENDS = (b",", b"\n", b"\r")
+
+class MisalignedChunk(Exception):
+    """ Raised for a chunk which ends inside a quoted field (its end was
+        guessed wrongly), the chunk has to be parsed together with the next one
+    """
+
+def _quoted(data) -> bool:
+    """ Guesses whether data starts inside a quoted field from the first quote
+        which can only open or close a field
+    """
+    parity = 0
+    position = data.find(b"\"")
+    while position >= 0:
+        before = data[position - 1:position] if position > 0 else b""
+        after = data[position + 1:position + 2]
+        if after == b"\"":
+            # escaped quote or empty field, the parity stays the same
+            position = data.find(b"\"", position + 2)
+            continue
+        if before in _FIELD_ENDS + (b" ",) and after not in _FIELD_ENDS + (b"",):
+            return parity == 1
+        if after in _FIELD_ENDS and before not in _FIELD_ENDS + (b" ", b""):
+            return parity == 0
+        parity ^= 1
+        position = data.find(b"\"", position + 1)
+    return False
+
+def _boundary(f, offset) -> int:
+    """ Offset of the first record boundary (a newline outside of quoted
+        fields) at or after offset, the end of the file if there is none
+    """
+    f.seek(offset)
+    data = f.read(_WINDOW)
+    quoted = offset > 0 and _quoted(data)
+    position = 0
+    while True:
+        newline = data.find(b"\n", position)
+        if newline < 0:
+            block = f.read(_WINDOW)
+            if not block:
+                return offset + len(data)
+            data += block
+            continue
+        # quotes inside fields are doubled, so the parity tells whether
+        # the newline is inside a quoted field
+        quoted ^= data.count(b"\"", position, newline) % 2 == 1
+        if not quoted:
+            return offset + newline + 1
+        position = newline + 1
+
+def split_csv(path, chunkSize=67108864) -> Tuple[List[str], List[Tuple[int, int]]]:
+    """ Splits a csv file into chunks of roughly chunkSize bytes which end at
+        record boundaries (newlines outside of quoted fields)
+
+    Summary
+    -------
+    Only a few blocks around each chunk end are read: whether the end lies
+    inside a quoted field is guessed from the nearest quotes. A wrong guess
+    is detected by parse_chunk (MisalignedChunk) and handled by parse_csv.
+
+    Parameters
+    ----------
+    path: str
+        Path of the csv file
+    chunkSize: int, optional
+        Minimum size (in bytes) of a chunk
+
+    Returns
+    -------
+    Tuple[List[str], List[Tuple[int, int]]]
+        Header of the csv and (start, end) byte offsets of the chunks
+    """
+    chunks = []
+    with open(path, "rb") as f:
+        size = f.seek(0, io.SEEK_END)
+        start = _boundary(f, 0)
+        f.seek(0)
+        header = f.read(start)
+        while start < size:
+            end = size if start + chunkSize >= size else _boundary(f, start + chunkSize)
+            chunks.append((start, end))
+            start = end
+    return (_parse(header)[0] if header else [], chunks)
+
+def _parse(data, indices=None) -> List[List[str]]:
+    with io.TextIOWrapper(io.BytesIO(data), newline="") as f:
+        rows = list(csv.reader(f, skipinitialspace=True))
+    if indices is not None:
+        rows = [[row[i] if i < len(row) else None for i in indices] for row in rows]
+    return rows
+
+def parse_chunk(path, start, end, indices=None, columnar=False,
+                types=None) -> Union[List[List[str]], List[ColumnBuilder]]:
+    """ Parses the bytes from start to end of a csv file (run in worker processes)
+
+    Parameters
+    ----------
+    path: str
+        Path of the csv file
+    start: int
+        Offset of the first byte of the chunk
+    end: int
+        Offset after the last byte of the chunk
+    indices: List[int], optional
+        Indices of the columns to be kept (all if None)
+    columnar: bool, optional
+        If True, the values are converted into a typed builder per column
+        instead of being returned as rows
+    types: List[str], optional
+        Types of the columns if columnar (inferred from the chunk if None)
+
+    Returns
+    -------
+    Union[List[List[str]], List[ColumnBuilder]]
+        The rows (or typed columns) of the chunk
+
+    Raises
+    ------
+    MisalignedChunk
+        If the chunk ends inside a quoted field
+    """
+    with open(path, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+        if data.count(b"\"") % 2 == 1 and f.read(1):
+            raise MisalignedChunk("{}: chunk {}-{} ends inside a quoted field".format(
+                path, start, end))
+    rows = _parse(data, indices)
+    if not columnar:
+        return rows
+    width = len(indices) if indices is not None else max((len(r) for r in rows), default=0)
+    return [convert_values(i, ["" if i >= len(row) or row[i] is None else row[i] for row in rows],
+                           None if types is None else types[i])
+            for i in range(width)]
+
+def parse_csv(path, maxWorkers=None, chunkSize=67108864, indices=None, columnar=False,
+              types=None) -> Generator[Union[List[List[str]], List[ColumnBuilder]], None, None]:
+    """ Parses the chunks of a csv file in a process pool and yields their
+        results in the order of the file
+
+    Summary
+    -------
+    At most two chunks per worker are parsed or waiting to be consumed at
+    any time, so memory stays bounded by the chunk size. A chunk whose end
+    was guessed wrongly is parsed again together with the next chunk.
+
+    Parameters
+    ----------
+    path: str
+        Path of the csv file
+    maxWorkers: int, optional
+        Number of worker processes (number of CPUs if None)
+    chunkSize: int, optional
+        Minimum size (in bytes) of a chunk
+    indices: List[int], optional
+        Indices of the columns to be kept (all if None)
+    columnar: bool, optional
+        If True, each chunk is yielded as a typed builder per column, which
+        is far cheaper to send from the workers than the rows
+    types: List[str], optional
+        Types of the columns if columnar (inferred per chunk if None)
+
+    Yields
+    ------
+    Union[List[List[str]], List[ColumnBuilder]]
+        The rows (or typed columns) of each chunk (excluding the header)
+    """
+    (header, chunks) = split_csv(path, chunkSize)
+    window = 2 * (maxWorkers or os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=maxWorkers) as executor:
+        pending = deque()
+        chunks = iter(chunks)
+        try:
+            while True:
+                while len(pending) < window:
+                    chunk = next(chunks, None)
+                    if chunk is None:
+                        break
+                    pending.append((chunk, executor.submit(parse_chunk, path, chunk[0], chunk[1],
+                                                           indices, columnar, types)))
+                if len(pending) == 0:
+                    return
+                ((start, end), future) = pending.popleft()
+                try:
+                    result = future.result()
+                except MisalignedChunk:
+                    result = None
+                while result is None:
+                    # the next chunk started inside a quoted field, so it is
+                    # merged into this one
+                    if len(pending) > 0:
+                        ((_, end), future) = pending.popleft()
+                        future.cancel()
+                    else:
+                        (_, end) = next(chunks)
+                    try:
+                        result = parse_chunk(path, start, end, indices, columnar, types)
+                    except MisalignedChunk:
+                        pass
+                yield result
+        finally:
+            for (chunk, future) in pending:
+                future.cancel()
@@ -12,3 +12,12 @@ class CannotCreateRDPException(Exception):
 
 class CannotCreateMetadataException(CannotCreateRDPException):
     pass
+
+class BadResumptionTokenException(CannotCreateMetadataException):
+    pass
+
+class NotCachedException(Exception):
+    pass
+
+class CircuitOpenException(Exception):
+    pass
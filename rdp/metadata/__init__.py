@@ -290,11 +290,15 @@ class OaiPmhMetadata(Metadata):
 
         Parameters
         ----------
-        oaipmh: str
-            XML-encoded OAI-PMH response
+        oaipmh: str or dict
+            XML-encoded OAI-PMH GetRecord response or an already parsed
+            record element (e.g. from a ListRecords response)
         """
-        oaipmh = xmltodict.parse(oaipmh)
-        self.md = oaipmh["OAI-PMH"]["GetRecord"]["record"]["metadata"]["resource"]
+        if isinstance(oaipmh, dict):
+            record = oaipmh
+        else:
+            record = xmltodict.parse(oaipmh)["OAI-PMH"]["GetRecord"]["record"]
+        self.md = record["metadata"]["resource"]
 
     def _normalize(self, md=None) -> None:
         """ Normalizes the metadata (recursively)
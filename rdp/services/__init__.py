@@ -6,9 +6,12 @@
 # This file contains all code related to services (as a component of RDPs)
 #
 ################################################################################
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from typing import Generator, Dict, List, Tuple, Union
 import requests
-from typing import Generator, Dict, List
+import xmltodict
 
+from rdp.services.session import HttpSession
 from rdp.services.capacities import \
     RetrieveDataHttpHeaders, \
     RetrieveMetadata, \
@@ -16,8 +19,8 @@ from rdp.services.capacities import \
     ServiceCapacity
 from rdp.metadata.factory import MetadataFactory, Metadata
 from rdp.data import FileDataFactory, Data
-from rdp.exceptions import CannotCreateMetadataException
-from rdp.util import Bundle, LazyFile
+from rdp.exceptions import BadResumptionTokenException, CannotCreateMetadataException
+from rdp.util import Bundle, LazyFile, LRUCache
 
 class Service(object):
     """ Base class + interface for Services as a component of RDPS
@@ -26,18 +29,39 @@ class Service(object):
     ----------
     endpoint: str
         URL indicating the endpoint of the service
+    session: HttpSession, optional
+        Session used for all HTTP requests (if not given, the session of the
+        ServiceBundle the service is put into is used, or a new one is
+        created on first use)
+    priority: int, optional
+        Rank of the service among services with the same capacity in a
+        ServiceBundle (lower values are preferred, e.g. cheaper services)
 
     Attributes
     ----------
     endpoint: str
     protocol: str
         Name of the protocol used by this service
+    session: HttpSession
     See parameters
     """
-    def __init__(self, endpoint):
+    def __init__(self, endpoint, session=None, priority=0):
         self.endpoint = endpoint
         self.serviceCapacities = []
         self.credentials = {}
+        self._session = session
+        self.priority = priority
+
+    @property
+    def session(self) -> HttpSession:
+        if self._session is None:
+            self._session = HttpSession()
+        return self._session
+
+    def has_session(self) -> bool:
+        """ True if the service has a session (given or injected) of its own
+        """
+        return self._session is not None
 
     @property
     def protocol(self):
@@ -62,21 +86,91 @@ class Service(object):
         """
         self.credentials[credentials.__name__] = credentials
 
+    def inject_session(self, session: HttpSession) -> None:
+        """ allows to inject a (shared) HTTP session at run time
+        """
+        self._session = session
+
 class ServiceBundle(Bundle):
     """ Collection of services with methods to select a service best fit for a task
+
+    Parameters
+    ----------
+    credentials: list, optional
+        Credentials to be injected into the services needing them
+    session: HttpSession, optional
+        Pooled HTTP session shared by all services of the bundle which have
+        no session of their own (a new one is created if not given)
+    hedgeDelay: float, optional
+        If given, get_metadata sends a backup request to the next capable
+        service whenever no answer arrived within hedgeDelay seconds and
+        uses the first answer (None disables hedging)
+
+    Summary
+    -------
+    The bundle maintains a routing table from capacities to the services
+    providing them (ordered by priority, then insertion). It is updated in
+    put, so selecting a service does not scan the bundle. If the preferred
+    service fails, the next capable service is tried.
     """
-    def __init__(self, credentials=[]):
+    def __init__(self, credentials=[], session=None, hedgeDelay=None):
         Bundle.__init__(self)
         self.credentials = credentials
-
-    def put(self, itemType, item):
+        self.session = session if session is not None else HttpSession()
+        self.hedgeDelay = hedgeDelay
+        self._routes = {}
+        self._resolved = {}
+        self._inserted = 0
+
+    def put(self, itemType, item, priority=None):
+        if self.has(itemType):
+            self._unroute(self.get(itemType))
         Bundle.put(self, itemType, item)
+        if priority is not None:
+            item.priority = priority
+        self._inserted += 1
+        for sc in item.serviceCapacities:
+            routes = self._routes.setdefault(sc, [])
+            routes.append((item.priority, self._inserted, item))
+            routes.sort(key=lambda r: r[:2])
+        self._resolved = {}
+        if not item.has_session():
+            item.inject_session(self.session)
         if item.needs_credentials():
             for given_credential in self.credentials:
                 for needed_credential in item.needs_credentials():
                     if needed_credential == given_credential.__name__:
                         item.inject_credentials(credential)
 
+    def _unroute(self, item) -> None:
+        for sc in list(self._routes.keys()):
+            self._routes[sc] = [r for r in self._routes[sc] if r[2] is not item]
+        self._resolved = {}
+
+    def services_for(self, capacity) -> List[Service]:
+        """ Services providing a capacity, preferred services first
+
+        Parameters
+        ----------
+        capacity: type
+            Subclass of ServiceCapacity
+
+        Returns
+        -------
+        list
+            Services (empty if no service provides the capacity)
+        """
+        services = self._resolved.get(capacity)
+        if services is None:
+            # a service providing a capacity also provides all its specializations
+            routes = []
+            for sc in capacity.__mro__:
+                routes.extend(self._routes.get(sc, []))
+            routes.sort(key=lambda r: r[:2])
+            services = [r[2] for r in routes]
+            self._resolved[capacity] = services
+        return services
+
     def get_metadata(self, identifier, scheme) -> Metadata:
         """ Get a metadata object for the RDP
 
@@ -92,11 +186,40 @@ class ServiceBundle(Bundle):
         Metadata
             Metadata object for RDP in format specified by scheme
         """
-        for key, service in self.payload.items():
-            if service.can(RetrieveMetadata()):
+        services = self.services_for(RetrieveMetadata)
+        if self.hedgeDelay is not None and len(services) > 1:
+            return self._get_metadata_hedged(services, identifier, scheme)
+        for (idx, service) in enumerate(services):
+            try:
                 return service.get_metadata(identifier, scheme)
+            except Exception:
+                if idx == len(services) - 1:
+                    raise
         return None
 
+    def _get_metadata_hedged(self, services, identifier, scheme) -> Metadata:
+        # the request of a losing service cannot be interrupted, its result is discarded
+        remaining = list(services)
+        pending = set()
+        error = None
+        executor = ThreadPoolExecutor(max_workers=len(services))
+        try:
+            while True:
+                if remaining:
+                    pending.add(executor.submit(remaining.pop(0).get_metadata, identifier, scheme))
+                elif not pending:
+                    raise error
+                (done, pending) = wait(pending, timeout=self.hedgeDelay if remaining else None,
+                                       return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future.exception() is None:
+                        return future.result()
+                    error = future.exception()
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=False)
+
     def get_data(self, identifier) -> Generator[Data, None, None]:
         """ Get all data objects for the RDP
 
@@ -110,10 +233,23 @@ class ServiceBundle(Bundle):
         Data
             Data objects for an RDP
         """
-        for key, service in self.payload.items():
-            if service.can(RetrieveData()):
-                return service.get_data(identifier)
-        return None
+        services = self.services_for(RetrieveData)
+        if len(services) == 0:
+            return None
+        return self._get_data(services, identifier)
+
+    def _get_data(self, services, identifier) -> Generator[Data, None, None]:
+        # falls through to the next service only if nothing has been yielded yet
+        for (idx, service) in enumerate(services):
+            yielded = False
+            try:
+                for data in service.get_data(identifier):
+                    yielded = True
+                    yield data
+                return
+            except Exception:
+                if yielded or idx == len(services) - 1:
+                    raise
 
 ################################################################################
 # SPECIFIC SERVICE IMPLEMENTATIONS
@@ -128,15 +264,23 @@ class OaipmhService(Service):
     identifierPrefix: str, optional
         Prefix which will always be prepended to the identifier in OAI-PMH requests.
         Default value is the empty string.
+    session: HttpSession, optional
+        Session used for all HTTP requests
 
     Methods
     -------
     get_record(identifier, metadataPrefix="datacite")
         OAI-PMH GetRecord request to retrieve metadata for the RDP in format
         specified by metadataPrefix
+    pages(verb, metadataPrefix="datacite", ...) -> Generator[Tuple[List, str], None, None]
+        Pages of an OAI-PMH list request with the resumptionToken of the next page
+    list_records(metadataPrefix="datacite", ...) -> Generator[Metadata, None, None]
+        OAI-PMH ListRecords harvest following resumptionTokens
+    list_identifiers(metadataPrefix="datacite", ...) -> Generator[str, None, None]
+        OAI-PMH ListIdentifiers harvest following resumptionTokens
     """
-    def __init__(self, endpoint, identifierPrefix=""):
-        Service.__init__(self, endpoint)
+    def __init__(self, endpoint, identifierPrefix="", session=None):
+        Service.__init__(self, endpoint, session)
         self.identifierPrefix = identifierPrefix
         self.serviceCapacities.append(RetrieveMetadata)
 
@@ -160,7 +304,7 @@ class OaipmhService(Service):
             'metadataPrefix': metadataPrefix,
             'identifier': "{}{}".format(self.identifierPrefix, identifier)
         }
-        r = requests.get(self.endpoint, params)
+        r = self.session.get(self.endpoint, params)
         if r.status_code >= 400:
             raise CannotCreateMetadataException(
                 "Cannot create RDP with id {} via OAI-PMH; HTTP-Status-Code: {}".format(
@@ -170,6 +314,141 @@ class OaipmhService(Service):
         md_type = "oaipmh_{}".format(metadataPrefix)
         return MetadataFactory.create(md_type, r.content)
 
+    def _fetch_page(self, params) -> bytes:
+        r = self.session.get(self.endpoint, params)
+        if r.status_code >= 400:
+            raise CannotCreateMetadataException(
+                "Cannot harvest {} via OAI-PMH; HTTP-Status-Code: {}".format(
+                    params["verb"], r.status_code
+                )
+            )
+        return r.content
+
+    def pages(self, verb, metadataPrefix="datacite", setSpec=None, fromDate=None,
+              untilDate=None, resumptionToken=None) -> Generator[Tuple[List, str], None, None]:
+        """ Yields the items (records or headers) of all pages of a list request
+            together with the resumptionToken of the following page (None for
+            the last page). The next page is fetched in the background while
+            the items of the current page are consumed.
+
+        Parameters
+        ----------
+        verb: str
+            ListRecords or ListIdentifiers
+        metadataPrefix, setSpec, fromDate, untilDate, resumptionToken:
+            See list_records
+
+        Yields
+        ------
+        Tuple[List, str]
+            Items of a page (as parsed by xmltodict) and the resumptionToken
+            of the following page
+
+        Raises
+        ------
+        BadResumptionTokenException
+            If the server rejects a resumptionToken (e.g. because it expired)
+        """
+        if resumptionToken:
+            params = {'verb': verb, 'resumptionToken': resumptionToken}
+        else:
+            params = {'verb': verb, 'metadataPrefix': metadataPrefix}
+            if setSpec:
+                params['set'] = setSpec
+            if fromDate:
+                params['from'] = fromDate
+            if untilDate:
+                params['until'] = untilDate
+        executor = ThreadPoolExecutor(max_workers=1)
+        try:
+            page = executor.submit(self._fetch_page, params)
+            while page is not None:
+                oaipmh = xmltodict.parse(page.result())["OAI-PMH"]
+                if "error" in oaipmh:
+                    error = oaipmh["error"]
+                    code = error.get("@code") if isinstance(error, dict) else None
+                    if code == "noRecordsMatch":
+                        return
+                    if code == "badResumptionToken":
+                        raise BadResumptionTokenException(
+                            "Cannot harvest {} via OAI-PMH; resumptionToken expired or invalid".format(verb)
+                        )
+                    raise CannotCreateMetadataException(
+                        "Cannot harvest {} via OAI-PMH; OAI-PMH-Error: {}".format(verb, code)
+                    )
+                body = oaipmh.get(verb) or {}
+                token = body.get("resumptionToken")
+                if isinstance(token, dict):
+                    token = token.get("#text")
+                page = None
+                if token:
+                    page = executor.submit(
+                        self._fetch_page, {'verb': verb, 'resumptionToken': token}
+                    )
+                items = body.get("record" if verb == "ListRecords" else "header") or []
+                if isinstance(items, dict):
+                    items = [ items ]
+                yield (items, token)
+        finally:
+            executor.shutdown(wait=False)
+
+    def _strip_prefix(self, identifier) -> str:
+        if self.identifierPrefix and identifier.startswith(self.identifierPrefix):
+            return identifier[len(self.identifierPrefix):]
+        return identifier
+
+    def list_records(self, metadataPrefix="datacite", setSpec=None, fromDate=None,
+                     untilDate=None, resumptionToken=None) -> Generator[Metadata, None, None]:
+        """ OAI-PMH ListRecords harvest, following resumptionTokens until all
+            pages have been retrieved. Deleted records are skipped.
+
+        Parameters
+        ----------
+        metadataPrefix: str, optional
+            Format of the metadata records
+        setSpec: str, optional
+            Restricts the harvest to a set (e.g. a community)
+        fromDate: str, optional
+            Lower bound (datestamp) for selective harvesting
+        untilDate: str, optional
+            Upper bound (datestamp) for selective harvesting
+        resumptionToken: str, optional
+            Token to resume a previous harvest (other arguments are ignored)
+
+        Yields
+        ------
+        Metadata
+            Metadata objects in the format specified by metadataPrefix
+        """
+        md_type = "oaipmh_{}".format(metadataPrefix)
+        for (records, token) in self.pages("ListRecords", metadataPrefix, setSpec,
+                                            fromDate, untilDate, resumptionToken):
+            for record in records:
+                if record.get("metadata") is None:
+                    continue
+                yield MetadataFactory.create(md_type, record)
+
+    def list_identifiers(self, metadataPrefix="datacite", setSpec=None, fromDate=None,
+                         untilDate=None, resumptionToken=None) -> Generator[str, None, None]:
+        """ OAI-PMH ListIdentifiers harvest, following resumptionTokens until
+            all pages have been retrieved. Deleted records are skipped.
+
+        Parameters
+        ----------
+        See list_records
+
+        Yields
+        ------
+        str
+            Identifiers (without identifierPrefix) usable with get_metadata
+        """
+        for (headers, token) in self.pages("ListIdentifiers", metadataPrefix, setSpec,
+                                            fromDate, untilDate, resumptionToken):
+            for header in headers:
+                if header.get("@status") == "deleted":
+                    continue
+                yield self._strip_prefix(header["identifier"])
+
 class ZenodoRestService(Service):
     """ Zenodo Rest API service for an RDP
 
@@ -177,14 +456,41 @@ class ZenodoRestService(Service):
     ---------
     endpoint: str
         URL indicating the endpoint of the service
+    session: HttpSession, optional
+        Session used for all HTTP requests
+    chunkSize: int, optional
+        Size (in bytes) of the buffer used to stream file downloads
+    recordCache: LRUCache, optional
+        Cache for record lookups keyed by zenodoId (a new one with a time to
+        live of one hour is created if not given)
+    store: BlobStore, optional
+        Local store shared by the files of all RDPs (files are kept in
+        temporary files otherwise)
+    memoryThreshold: int, optional
+        Files up to this size (in bytes) are kept in memory instead of
+        temporary files (ignored if a store is given)
+    textCache: TextCache, optional
+        On-disk cache of the texts extracted from the files
 
     Methods
     -------
     get_files(zenodo_Id) -> Generator[Data, None, None]
         Yields all Data objects of the RDP retrievable by the zenodo API
+    resolve_records(zenodoIds, batchSize=25, pageSize=25) -> Dict[str, Dict]
+        Resolves many records with few search requests and caches them
+    get_headers(zenodoId, maxWorkers=8) -> Generator[Dict, None, None]
+        Yields the HTTP headers of all files of the RDP (in order)
+    get_headers_as_completed(zenodoId, maxWorkers=8) -> Generator[Tuple, None, None]
+        Yields (source, headers) for all files of the RDP as soon as available
     """
-    def __init__(self, endpoint):
-        Service.__init__(self, endpoint)
+    def __init__(self, endpoint, session=None, chunkSize=1048576, recordCache=None, store=None,
+                 memoryThreshold=None, textCache=None):
+        Service.__init__(self, endpoint, session)
+        self.chunkSize = chunkSize
+        self.store = store
+        self.memoryThreshold = memoryThreshold
+        self.textCache = textCache
+        self.recordCache = recordCache if recordCache is not None else LRUCache(1024, 3600)
         self.serviceCapacities.append(RetrieveData)
         self.serviceCapacities.append(RetrieveDataHttpHeaders)
 
@@ -192,18 +498,123 @@ class ZenodoRestService(Service):
     def protocol(self):
         return "zenodo-rest"
 
-    def download(source:str) -> bytes:
-        r = requests.get(source)
+    def download(self, source:str) -> bytes:
+        r = self.session.get(source)
+        if r.status_code != 200:
+            raise requests.exceptions.HTTPError(
+                "Cannot download {}; HTTP-Status-Code: {}".format(source, r.status_code),
+                response=r)
         return r.content
 
-    def _get_files_sources(self, zenodoId) -> List[str]:
-        r = requests.get("{}/records/?q=recid:{}".format(self.endpoint, zenodoId))
+    def stream(self, source:str, offset:int=0) -> Generator[bytes, None, None]:
+        """ Streams the file at source in chunks of at most chunkSize bytes
+
+        Parameters
+        ----------
+        source: str
+            URL of the file
+        offset: int, optional
+            Position in the file to start at (requested via an HTTP Range
+            header; if the server ignores it, the leading bytes are skipped)
+
+        Yields
+        ------
+        bytes
+            Chunks of the file
+
+        Raises
+        ------
+        requests.exceptions.HTTPError
+            If the server answers with a status other than 200 or 206 (so
+            error pages never end up in the file)
+        """
+        headers = {"Range": "bytes={}-".format(offset)} if offset > 0 else {}
+        with self.session.get(source, stream=True, headers=headers) as r:
+            if r.status_code == 416 and offset > 0 and \
+                    (r.headers or {}).get("Content-Range") == "bytes */{}".format(offset):
+                # the partial file is already complete
+                return
+            if r.status_code not in (200, 206):
+                raise requests.exceptions.HTTPError(
+                    "Cannot download {}; HTTP-Status-Code: {}".format(source, r.status_code),
+                    response=r)
+            skip = offset if r.status_code != 206 else 0
+            for chunk in r.iter_content(chunk_size=self.chunkSize):
+                if skip > 0:
+                    (skip, chunk) = (max(0, skip - len(chunk)), chunk[skip:])
+                if chunk:
+                    yield chunk
+
+    def _get_record(self, zenodoId) -> Dict:
+        record = self.recordCache.get(zenodoId)
+        if record is not None:
+            return record
+        r = self.session.get("{}/records/?q=recid:{}".format(self.endpoint, zenodoId))
         restJson = r.json()
         if not "hits" in restJson.keys():
             raise ValueError("{} does not seem to be a valid zenodoId".format(zenodoId))
         if restJson["hits"]["total"] != 1:
             raise ValueError("{} does not unambiguously identify a zenodo record".format(zenodoId))
-        return restJson["hits"]["hits"][0]["files"]
+        record = restJson["hits"]["hits"][0]
+        self.recordCache.put(zenodoId, record)
+        return record
+
+    def resolve_records(self, zenodoIds, batchSize=50, pageSize=100) -> Dict[str, Dict]:
+        """ Resolves many records with OR-combined search requests
+            (recid:(a OR b OR ...)) and keeps them in the record cache, so
+            later calls of get_data or get_headers need no further lookup.
+
+        Parameters
+        ----------
+        zenodoIds: list
+            Ids used by zenodo to identify depositions
+        batchSize: int, optional
+            Number of ids combined in one search request
+        pageSize: int, optional
+            Number of records requested per result page (zenodo allows at
+            most 25 for anonymous requests and may return fewer)
+
+        Returns
+        -------
+        dict
+            Records keyed by zenodoId (ids which could not be resolved are missing)
+        """
+        records = {}
+        missing = []
+        for zenodoId in dict.fromkeys(str(z) for z in zenodoIds):
+            record = self.recordCache.get(zenodoId)
+            if record is not None:
+                records[zenodoId] = record
+            else:
+                missing.append(zenodoId)
+        for i in range(0, len(missing), batchSize):
+            batch = set(missing[i:i+batchSize])
+            params = {
+                'q': "recid:({})".format(" OR ".join(missing[i:i+batchSize])),
+                'size': pageSize,
+                'page': 1
+            }
+            received = 0
+            while True:
+                restJson = self.session.get("{}/records/".format(self.endpoint), dict(params)).json()
+                if not "hits" in restJson.keys():
+                    raise ValueError("Cannot resolve zenodoIds: {}".format(params['q']))
+                hits = restJson["hits"]["hits"]
+                for hit in hits:
+                    zenodoId = str(hit.get("id"))
+                    if zenodoId in batch:
+                        records[zenodoId] = hit
+                        self.recordCache.put(zenodoId, hit)
+                received += len(hits)
+                # the server may return fewer hits per page than requested
+                if len(hits) == 0 or received >= restJson["hits"]["total"] or \
+                        "next" not in restJson.get("links", {"next": None}):
+                    break
+                params['page'] += 1
+        return records
+
+    def _get_files_sources(self, zenodoId) -> List[str]:
+        return self._get_record(zenodoId)["files"]
 
     def get_data(self, zenodoId) -> Generator[Data, None, None]:
         """ Yields all Data objects of the RDP retrievable by the zenodo API
@@ -218,14 +629,78 @@ class ZenodoRestService(Service):
         Data
             Data objects for an RDP
         """
-        # TODO caching
         for data_item in self._get_files_sources(zenodoId):
             yield FileDataFactory.create(
-                LazyFile(data_item["links"]["self"], ZenodoRestService.download)
+                LazyFile(data_item["links"]["self"], self.stream,
+                         size=data_item.get("size"), resumable=True,
+                         checksum=data_item.get("checksum"), store=self.store,
+                         memoryThreshold=self.memoryThreshold),
+                self.textCache
             )
 
-    def get_headers(self, zenodoId) -> Generator[Dict, None, None]:
-        for data_item in self._get_files_sources(zenodoId):
-            r = requests.head(data_item["links"]["self"])
-            yield r.headers
+    def _head(self, source) -> Union[Dict, Exception]:
+        try:
+            return self.session.head(source).headers
+        except Exception as e:
+            return e
+
+    def get_headers(self, zenodoId, maxWorkers=8) -> Generator[Union[Dict, Exception], None, None]:
+        """ Yields the HTTP headers of all files of the RDP in the order of the
+            files. The HEAD requests are sent concurrently.
+
+        Parameters
+        ----------
+        zenodoId: str
+            Id used by zenodo to identify depositions
+        maxWorkers: int, optional
+            Maximum number of concurrent HEAD requests (should not exceed the
+            pool size of the session)
+
+        Yields
+        ------
+        Dict
+            HTTP headers of a file, or the exception raised while requesting them
+        """
+        sources = [d["links"]["self"] for d in self._get_files_sources(zenodoId)]
+        if maxWorkers <= 1 or len(sources) <= 1:
+            for source in sources:
+                yield self._head(source)
+            return
+        executor = ThreadPoolExecutor(max_workers=maxWorkers)
+        futures = [executor.submit(self._head, source) for source in sources]
+        try:
+            for future in futures:
+                yield future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+    def get_headers_as_completed(self, zenodoId, maxWorkers=8) -> Generator[Tuple[str, Union[Dict, Exception]], None, None]:
+        """ Yields the HTTP headers of all files of the RDP as soon as they are
+            available. The HEAD requests are sent concurrently.
+
+        Parameters
+        ----------
+        zenodoId: str
+            Id used by zenodo to identify depositions
+        maxWorkers: int, optional
+            Maximum number of concurrent HEAD requests
+
+        Yields
+        ------
+        Tuple
+            Source of the file and its HTTP headers (or the exception raised
+            while requesting them)
+        """
+        sources = [d["links"]["self"] for d in self._get_files_sources(zenodoId)]
+        executor = ThreadPoolExecutor(max_workers=max(1, maxWorkers))
+        futures = {executor.submit(self._head, source): source for source in sources}
+        try:
+            for future in as_completed(futures):
+                yield (futures[future], future.result())
+        finally:
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=False)
 
@@ -0,0 +1,240 @@
+################################################################################
+# Copyright: Tobias Weber 2020
+#
+# Apache 2.0 License
+#
+# This file contains all code related to caching HTTP responses of services
+#
+################################################################################
+import hashlib
+import io
+import json
+import os
+import tempfile
+import threading
+
+import requests
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+class HttpCache(object):
+    """ Persistent on-disk cache for HTTP GET responses
+
+    Summary
+    -------
+    Successful responses are stored together with their validators (ETag,
+    Last-Modified). Subsequent requests for the same URL are sent as
+    conditional requests; a 304 response is served from disk. The total size
+    of all cached bodies is capped, least recently used entries are evicted
+    first; responses larger than maxSize are not cached. In offline mode no
+    request is sent at all (HEAD requests are answered with the headers of
+    cached GET responses).
+
+    Parameters
+    ----------
+    directory: str
+        Directory in which responses are stored (created if missing)
+    maxSize: int, optional
+        Maximum total size (in bytes) of all cached bodies
+    offline: bool, optional
+        If True, responses are only served from the cache
+
+    Methods
+    -------
+    key(url, params=None) -> str
+        Key of the cache entry for a request
+    lookup(key) -> dict
+        Metadata of the cache entry (None if not cached)
+    validators(entry) -> dict
+        Headers for a conditional request revalidating the entry
+    response(key, entry, stream=False) -> requests.Response
+        Response served from the cache
+    store(key, response, stream=False) -> requests.Response
+        Stores a response (while it is consumed, if streamed)
+    head(key, entry) -> requests.Response
+        Response to a HEAD request served from the cache
+    """
+    def __init__(self, directory, maxSize=1073741824, offline=False):
+        self.directory = directory
+        self.maxSize = maxSize
+        self.offline = offline
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key, suffix) -> str:
+        return os.path.join(self.directory, "{}.{}".format(key, suffix))
+
+    def key(self, url, params=None) -> str:
+        """ Key of the cache entry for a request
+        """
+        request = requests.Request("GET", url, params=params).prepare()
+        return hashlib.sha256(request.url.encode("utf-8")).hexdigest()
+
+    def lookup(self, key) -> dict:
+        """ Metadata of the cache entry (None if not cached)
+        """
+        try:
+            with open(self._path(key, "json"), "r") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not os.path.exists(self._path(key, "body")):
+            return None
+        return entry
+
+    def validators(self, entry) -> dict:
+        """ Headers for a conditional request revalidating the entry
+        """
+        headers = {}
+        for (header, validator) in (("ETag", "If-None-Match"),
+                                    ("Last-Modified", "If-Modified-Since")):
+            value = CaseInsensitiveDict(entry["headers"]).get(header)
+            if value:
+                headers[validator] = value
+        return headers
+
+    def response(self, key, entry, stream=False) -> requests.Response:
+        """ Response served from the cache (marks the entry as recently used).
+            If stream is False, the body is read into memory right away.
+        """
+        body = self._path(key, "body")
+        os.utime(body)
+        response = requests.Response()
+        response.status_code = entry["status"]
+        response.url = entry["url"]
+        response.headers = CaseInsensitiveDict(entry["headers"])
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.raw = open(body, "rb")
+        if not stream:
+            response.content
+            response.close()
+        return response
+
+    def store(self, key, response, stream=False) -> requests.Response:
+        """ Stores a response. Responses larger than maxSize are not cached.
+            If stream is True, the body is written to the cache while the
+            caller consumes it (the entry is committed once it is complete).
+        """
+        length = response.headers.get("Content-Length")
+        if length is not None and length.isdigit() and int(length) > self.maxSize:
+            return response
+        entry = {
+            "url": response.url,
+            "status": response.status_code,
+            "headers": dict(response.headers)
+        }
+        if not stream:
+            if len(response.content) <= self.maxSize:
+                (fd, tmp) = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+                with os.fdopen(fd, "wb") as f:
+                    f.write(response.content)
+                self._commit(key, entry, tmp)
+            return response
+        cached = requests.Response()
+        cached.status_code = response.status_code
+        cached.url = response.url
+        cached.headers = CaseInsensitiveDict(response.headers)
+        cached.encoding = get_encoding_from_headers(cached.headers)
+        cached.raw = _CachingReader(self, key, entry, response)
+        return cached
+
+    def head(self, key, entry) -> requests.Response:
+        """ Response to a HEAD request served from the cache (headers only)
+        """
+        response = requests.Response()
+        response.status_code = entry["status"]
+        response.url = entry["url"]
+        response.headers = CaseInsensitiveDict(entry["headers"])
+        response._content = b""
+        return response
+
+    def _commit(self, key, entry, tmp) -> None:
+        with self._lock:
+            os.replace(tmp, self._path(key, "body"))
+            with open(self._path(key, "json"), "w") as f:
+                json.dump(entry, f)
+            self._evict()
+
+    def size(self) -> int:
+        """ Total size (in bytes) of all cached bodies
+        """
+        return sum(os.path.getsize(p) for (p, mtime) in self._bodies())
+
+    def _bodies(self):
+        bodies = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".body"):
+                path = os.path.join(self.directory, name)
+                try:
+                    bodies.append((path, os.path.getmtime(path)))
+                except OSError:
+                    pass
+        return bodies
+
+    def _evict(self) -> None:
+        bodies = sorted(self._bodies(), key=lambda b: b[1])
+        total = sum(os.path.getsize(p) for (p, mtime) in bodies)
+        while total > self.maxSize and len(bodies) > 0:
+            (path, mtime) = bodies.pop(0)
+            total -= os.path.getsize(path)
+            os.unlink(path)
+            meta = "{}.json".format(path[:-len(".body")])
+            if os.path.exists(meta):
+                os.unlink(meta)
+
+class _CachingReader(io.RawIOBase):
+    """ Body of a streamed response which is written to the cache as it is read
+    """
+    def __init__(self, cache, key, entry, response):
+        self.cache = cache
+        self.key = key
+        self.entry = entry
+        self.response = response
+        self._chunks = response.iter_content(chunk_size=65536)
+        self._buffer = b""
+        self._written = 0
+        (fd, self._tmp) = tempfile.mkstemp(dir=cache.directory, suffix=".tmp")
+        self._file = os.fdopen(fd, "wb")
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._buffer:
+            chunk = next(self._chunks, None) if not self.closed else None
+            if chunk is None:
+                self._finish(True)
+                return 0
+            self._buffer = chunk
+            if self._file is not None:
+                self._written += len(chunk)
+                if self._written > self.cache.maxSize:
+                    self._discard()
+                else:
+                    self._file.write(chunk)
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+    def _discard(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            os.unlink(self._tmp)
+
+    def _finish(self, complete):
+        if self._file is not None:
+            if complete:
+                self._file.close()
+                self._file = None
+                self.cache._commit(self.key, self.entry, self._tmp)
+            else:
+                self._discard()
+        self.response.close()
+
+    def close(self):
+        if not self.closed:
+            # an incompletely consumed body is not cached
+            self._finish(False)
+        super().close()
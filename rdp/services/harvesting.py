@@ -0,0 +1,136 @@
+################################################################################
+# Copyright: Tobias Weber 2020
+#
+# Apache 2.0 License
+#
+# This file contains all code related to incremental harvesting of services
+#
+################################################################################
+import json
+import os
+from typing import Generator
+
+from rdp.exceptions import BadResumptionTokenException
+from rdp.metadata.factory import MetadataFactory, Metadata
+
+class OaipmhHarvester(object):
+    """ Incremental OAI-PMH harvester persisting its progress to a checkpoint file
+
+    Summary
+    -------
+    The first run harvests all records (optionally restricted by fromDate).
+    Each subsequent run only requests records changed since the latest
+    datestamp of the previous run. After each completely consumed page the
+    resumptionToken of the next page is persisted, so an interrupted harvest
+    continues with the page it stopped at. If that token has expired in the
+    meantime, the harvest restarts at the beginning of its window (records
+    are not ordered by datestamp, so records already yielded may be yielded
+    again).
+
+    Parameters
+    ----------
+    service: OaipmhService
+        Service used to harvest the records
+    checkpoint: str
+        Path of the (JSON) checkpoint file
+    metadataPrefix: str, optional
+        Format of the metadata records
+    setSpec: str, optional
+        Restricts the harvest to a set (e.g. a community)
+
+    Methods
+    -------
+    harvest(fromDate=None, untilDate=None) -> Generator[Metadata, None, None]
+        Yields all records changed since the last successful harvest
+    reset() -> None
+        Removes the checkpoint, the next harvest will be a full one
+    """
+    def __init__(self, service, checkpoint, metadataPrefix="datacite", setSpec=None):
+        self.service = service
+        self.checkpoint = checkpoint
+        self.metadataPrefix = metadataPrefix
+        self.setSpec = setSpec
+
+    def _load(self) -> dict:
+        if not os.path.exists(self.checkpoint):
+            return {}
+        with open(self.checkpoint, "r") as f:
+            state = json.load(f)
+        if state.get("metadataPrefix") != self.metadataPrefix or \
+                state.get("set") != self.setSpec:
+            raise ValueError("Checkpoint {} belongs to another harvest ({}, {})".format(
+                self.checkpoint, state.get("metadataPrefix"), state.get("set")))
+        return state
+
+    def _save(self, state) -> None:
+        state["metadataPrefix"] = self.metadataPrefix
+        state["set"] = self.setSpec
+        tmp = "{}.tmp".format(self.checkpoint)
+        with open(tmp, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp, self.checkpoint)
+
+    @property
+    def datestamp(self) -> str:
+        """ Latest datestamp of all records harvested so far (None if none)
+        """
+        return self._load().get("datestamp")
+
+    def reset(self) -> None:
+        """ Removes the checkpoint, the next harvest will be a full one
+        """
+        if os.path.exists(self.checkpoint):
+            os.unlink(self.checkpoint)
+
+    def harvest(self, fromDate=None, untilDate=None) -> Generator[Metadata, None, None]:
+        """ Yields all records changed since the last successful harvest
+            (or resumes an interrupted one)
+
+        Parameters
+        ----------
+        fromDate: str, optional
+            Lower bound (datestamp), only used if no checkpoint exists
+        untilDate: str, optional
+            Upper bound (datestamp) of the harvest
+
+        Yields
+        ------
+        Metadata
+            Metadata objects in the format specified by metadataPrefix
+        """
+        state = self._load()
+        if state.get("resumptionToken"):
+            fromDate = state.get("from")
+            untilDate = state.get("until")
+        elif state.get("datestamp"):
+            fromDate = state["datestamp"]
+        state["from"] = fromDate
+        state["until"] = untilDate
+        # latest datestamp of the running harvest, committed once it is complete
+        pending = state.get("pending", state.get("datestamp"))
+        md_type = "oaipmh_{}".format(self.metadataPrefix)
+        while True:
+            try:
+                for (records, token) in self.service.pages(
+                        "ListRecords", self.metadataPrefix, self.setSpec,
+                        state["from"], state["until"], state.get("resumptionToken")):
+                    for record in records:
+                        datestamp = (record.get("header") or {}).get("datestamp")
+                        if datestamp and (pending is None or datestamp > pending):
+                            pending = datestamp
+                        if record.get("metadata") is None:
+                            continue
+                        yield MetadataFactory.create(md_type, record)
+                    state["resumptionToken"] = token
+                    state["pending"] = pending
+                    if token is None:
+                        state["datestamp"] = state.pop("pending")
+                    self._save(state)
+                return
+            except BadResumptionTokenException:
+                if not state.get("resumptionToken"):
+                    raise
+                # the token expired: restart the window at its start, records
+                # are not ordered by datestamp (so some may be yielded again)
+                state["resumptionToken"] = None
+                self._save(state)
@@ -0,0 +1,216 @@
+################################################################################
+# Copyright: Tobias Weber 2020
+#
+# Apache 2.0 License
+#
+# This file contains all code related to rate limiting requests of services
+#
+################################################################################
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+class TokenBucket(object):
+    """ Token bucket allowing rate requests per second with bursts up to capacity
+
+    Parameters
+    ----------
+    rate: float
+        Tokens added per second
+    capacity: float, optional
+        Maximum number of tokens (defaults to rate, but at least 1)
+    """
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._pausedUntil = 0.0
+        self._lock = threading.Lock()
+
+    def pause(self, seconds) -> None:
+        """ Hands out no tokens for the given number of seconds
+        """
+        with self._lock:
+            self._pausedUntil = max(self._pausedUntil, time.monotonic() + seconds)
+            self._tokens = 0.0
+
+    def acquire(self) -> None:
+        """ Blocks until a token is available and takes it
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self._pausedUntil:
+                    wait = self._pausedUntil - now
+                else:
+                    self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                    self._last = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+class AdaptiveConcurrency(object):
+    """ Concurrency limit which is halved whenever requests are throttled and
+        grows by one after a full window of successful requests (AIMD)
+
+    Parameters
+    ----------
+    initial: int, optional
+        Initial number of concurrent requests
+    minimum: int, optional
+        Lower bound of the limit
+    maximum: int, optional
+        Upper bound of the limit
+    """
+    def __init__(self, initial=4, minimum=1, maximum=16):
+        self.limit = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.active = 0
+        self._successes = 0
+        self._condition = threading.Condition()
+
+    def acquire(self) -> None:
+        with self._condition:
+            while self.active >= self.limit:
+                self._condition.wait()
+            self.active += 1
+
+    def release(self, throttled=False) -> None:
+        with self._condition:
+            self.active -= 1
+            if throttled:
+                self.limit = max(self.minimum, self.limit // 2)
+                self._successes = 0
+            else:
+                self._successes += 1
+                if self._successes >= self.limit and self.limit < self.maximum:
+                    self.limit += 1
+                    self._successes = 0
+            self._condition.notify_all()
+
+class _HostLimit(object):
+    def __init__(self, bucket, concurrency):
+        self.bucket = bucket
+        self.concurrency = concurrency
+
+class RateLimiter(object):
+    """ Per-host rate limiting shared by all services using the same HttpSession
+
+    Summary
+    -------
+    Each host gets a token bucket and an adaptive concurrency limit.
+    Throttled responses (429, 503 with Retry-After) pause the host for the
+    time given in Retry-After and shrink its concurrency, an exhausted
+    X-RateLimit-Remaining pauses the host until X-RateLimit-Reset.
+
+    Parameters
+    ----------
+    rate: float, optional
+        Requests per second and host
+    burst: float, optional
+        Maximum burst of requests per host
+    concurrency: int, optional
+        Initial number of concurrent requests per host
+    minConcurrency: int, optional
+        Lower bound of concurrent requests per host
+    maxConcurrency: int, optional
+        Upper bound of concurrent requests per host
+    maxRetries: int, optional
+        Number of times a throttled request is sent again
+    defaultBackoff: float, optional
+        Pause (in seconds) if a throttled response carries no Retry-After
+
+    Methods
+    -------
+    acquire(url) -> None
+        Blocks until a request to url may be sent
+    release(url, response=None) -> bool
+        Records the response of a request, returns True if it was throttled
+    """
+    def __init__(self, rate=10.0, burst=None, concurrency=4, minConcurrency=1,
+                 maxConcurrency=16, maxRetries=3, defaultBackoff=1.0):
+        self.rate = rate
+        self.burst = burst
+        self.concurrency = concurrency
+        self.minConcurrency = minConcurrency
+        self.maxConcurrency = maxConcurrency
+        self.maxRetries = maxRetries
+        self.defaultBackoff = defaultBackoff
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def host(self, url) -> _HostLimit:
+        """ Limits of the host of url (created on first use)
+        """
+        host = urlsplit(url).netloc
+        with self._lock:
+            if host not in self._hosts:
+                self._hosts[host] = _HostLimit(
+                    TokenBucket(self.rate, self.burst),
+                    AdaptiveConcurrency(self.concurrency, self.minConcurrency, self.maxConcurrency)
+                )
+            return self._hosts[host]
+
+    def acquire(self, url) -> None:
+        """ Blocks until a request to url may be sent
+        """
+        limit = self.host(url)
+        limit.concurrency.acquire()
+        limit.bucket.acquire()
+
+    def release(self, url, response=None) -> bool:
+        """ Records the response of a request (None if it failed) and adapts
+            the limits of the host
+
+        Returns
+        -------
+        bool
+            True if the request was throttled
+        """
+        limit = self.host(url)
+        throttled = False
+        try:
+            if response is not None:
+                headers = response.headers or {}
+                retryAfter = _parse_retry_after(headers.get("Retry-After"))
+                if response.status_code == 429 or \
+                        (response.status_code == 503 and retryAfter is not None):
+                    throttled = True
+                    limit.bucket.pause(retryAfter if retryAfter is not None else self.defaultBackoff)
+                elif headers.get("X-RateLimit-Remaining") == "0":
+                    reset = _parse_float(headers.get("X-RateLimit-Reset"))
+                    if reset is not None:
+                        limit.bucket.pause(max(0.0, reset - time.time()))
+        finally:
+            # the slot must be returned even if the headers cannot be parsed
+            limit.concurrency.release(throttled)
+        return throttled
+
+def _parse_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def _parse_retry_after(value):
+    """ Seconds to wait according to a Retry-After header (seconds or HTTP-date)
+    """
+    if value is None:
+        return None
+    seconds = _parse_float(value)
+    if seconds is not None:
+        return max(0.0, seconds)
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if date.tzinfo is None:
+        # dates without zone (or with -0000) are meant to be GMT
+        date = date.replace(tzinfo=timezone.utc)
+    return max(0.0, (date - datetime.now(timezone.utc)).total_seconds())
@@ -0,0 +1,148 @@
+################################################################################
+# Copyright: Tobias Weber 2020
+#
+# Apache 2.0 License
+#
+# This file contains all code related to retrying requests of services
+#
+################################################################################
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+from rdp.exceptions import CircuitOpenException
+
+class RetryPolicy(object):
+    """ Retries with exponential backoff and full jitter for idempotent requests
+
+    Parameters
+    ----------
+    retries: int, optional
+        Number of times a failed request is sent again
+    backoff: float, optional
+        Base delay (in seconds), doubled with each attempt
+    maxBackoff: float, optional
+        Upper bound of the delay (in seconds)
+    jitter: bool, optional
+        If True, the delay is drawn uniformly from [0, backoff * 2^attempt]
+    statuses: tuple, optional
+        HTTP status codes considered transient failures
+
+    Methods
+    -------
+    retryable(response) -> bool
+        True if the response indicates a transient failure
+    delay(attempt) -> float
+        Delay (in seconds) before the given retry (starting at 0)
+    """
+    def __init__(self, retries=3, backoff=0.5, maxBackoff=30.0, jitter=True,
+                 statuses=(500, 502, 503, 504)):
+        self.retries = retries
+        self.backoff = backoff
+        self.maxBackoff = maxBackoff
+        self.jitter = jitter
+        self.statuses = statuses
+
+    def retryable(self, response) -> bool:
+        return response is None or response.status_code in self.statuses
+
+    def delay(self, attempt) -> float:
+        delay = min(self.maxBackoff, self.backoff * (2 ** attempt))
+        if self.jitter:
+            delay = random.uniform(0, delay)
+        return delay
+
+class _Circuit(object):
+    def __init__(self):
+        self.state = CircuitBreaker.CLOSED
+        self.failures = 0
+        self.openedAt = 0.0
+        self.probing = False
+
+def _endpoint(url) -> str:
+    """ Host and first path segment of url (e.g. zenodo.org/api), which
+        tells the services of a host apart
+    """
+    parts = urlsplit(url)
+    return "{}/{}".format(parts.netloc, parts.path.lstrip("/").split("/", 1)[0])
+
+class CircuitBreaker(object):
+    """ Per-endpoint circuit breaker
+
+    Summary
+    -------
+    After failureThreshold consecutive failures the circuit of an endpoint
+    opens and requests fail fast with a CircuitOpenException. After
+    resetTimeout seconds a single probe request is let through (half-open);
+    its success closes the circuit, its failure opens it again. By default
+    an endpoint is the host and the first path segment of the URL, so e.g.
+    an outage of zenodo.org/oai2d does not affect zenodo.org/api.
+
+    Parameters
+    ----------
+    failureThreshold: int, optional
+        Number of consecutive failures opening the circuit
+    resetTimeout: float, optional
+        Time (in seconds) until an open circuit is probed
+    key: Callable[[str], str], optional
+        Maps a URL to the key of its circuit (host and first path segment if None)
+
+    Methods
+    -------
+    before(url) -> None
+        Raises CircuitOpenException if requests to the endpoint of url must not be sent
+    record(url, success) -> None
+        Records the outcome of a request
+    state(url) -> str
+        State of the circuit of the endpoint of url
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, failureThreshold=5, resetTimeout=30.0, key=None):
+        self.failureThreshold = failureThreshold
+        self.resetTimeout = resetTimeout
+        self.key = key or _endpoint
+        self._circuits = {}
+        self._lock = threading.Lock()
+
+    def _circuit(self, url) -> _Circuit:
+        key = self.key(url)
+        if key not in self._circuits:
+            self._circuits[key] = _Circuit()
+        return self._circuits[key]
+
+    def state(self, url) -> str:
+        with self._lock:
+            return self._circuit(url).state
+
+    def before(self, url) -> None:
+        with self._lock:
+            circuit = self._circuit(url)
+            if circuit.state == CircuitBreaker.OPEN and \
+                    time.monotonic() - circuit.openedAt >= self.resetTimeout:
+                circuit.state = CircuitBreaker.HALF_OPEN
+                circuit.probing = False
+            if circuit.state == CircuitBreaker.CLOSED:
+                return
+            if circuit.state == CircuitBreaker.HALF_OPEN and not circuit.probing:
+                circuit.probing = True
+                return
+        raise CircuitOpenException(
+            "Circuit for {} is open, request is not sent".format(self.key(url)))
+
+    def record(self, url, success) -> None:
+        with self._lock:
+            circuit = self._circuit(url)
+            circuit.probing = False
+            if success:
+                circuit.state = CircuitBreaker.CLOSED
+                circuit.failures = 0
+                return
+            circuit.failures += 1
+            if circuit.state == CircuitBreaker.HALF_OPEN or \
+                    circuit.failures >= self.failureThreshold:
+                circuit.state = CircuitBreaker.OPEN
+                circuit.openedAt = time.monotonic()
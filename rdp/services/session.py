@@ -0,0 +1,191 @@
+################################################################################
+# Copyright: Tobias Weber 2020
+#
+# Apache 2.0 License
+#
+# This file contains all code related to HTTP sessions used by services
+#
+################################################################################
+import time
+from typing import Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from rdp.exceptions import NotCachedException
+
+class HttpSession(object):
+    """ Pooled keep-alive HTTP session which can be shared by several services
+
+    Parameters
+    ----------
+    poolConnections: int, optional
+        Number of per-host connection pools to cache
+    poolSize: int, optional
+        Maximum number of connections kept alive per host
+    keepAlive: bool, optional
+        If False, connections are closed after each request
+    session: requests.Session, optional
+        Session provided by the caller. If given, its adapters are not touched.
+    timeout: float, optional
+        Default timeout (in seconds) for all requests of this session
+    cache: HttpCache, optional
+        Persistent cache used for (non-range) GET requests
+    rateLimiter: RateLimiter, optional
+        Per-host rate limiting (throttled requests are sent again after the
+        time requested by the server)
+    retryPolicy: RetryPolicy, optional
+        Retries of requests failing with transient errors (5xx, connection
+        errors), throttled responses are only retried by the rate limiter
+    circuitBreaker: CircuitBreaker, optional
+        Per-endpoint circuit breaker letting requests to unhealthy endpoints fail fast
+
+    Methods
+    -------
+    get(url, params=None, **kwargs) -> requests.Response
+        HTTP GET request via the pooled connections
+    head(url, **kwargs) -> requests.Response
+        HTTP HEAD request via the pooled connections
+    close() -> None
+        Closes all pooled connections
+    """
+    def __init__(self, poolConnections=10, poolSize=10, keepAlive=True, session=None,
+                 timeout=None, cache=None, rateLimiter=None, retryPolicy=None,
+                 circuitBreaker=None):
+        self.poolConnections = poolConnections
+        self.poolSize = poolSize
+        self.keepAlive = keepAlive
+        self.timeout = timeout
+        self.cache = cache
+        self.rateLimiter = rateLimiter
+        self.retryPolicy = retryPolicy
+        self.circuitBreaker = circuitBreaker
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=poolConnections, pool_maxsize=poolSize)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+        if not keepAlive:
+            session.headers["Connection"] = "close"
+        self.session = session
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _kwargs(self, kwargs):
+        if self.timeout is not None:
+            kwargs.setdefault("timeout", self.timeout)
+        return kwargs
+
+    def _send(self, method, url, **kwargs) -> requests.Response:
+        attempt = 0
+        while True:
+            if self.circuitBreaker is not None:
+                self.circuitBreaker.before(url)
+            (response, error, throttled) = (None, None, False)
+            try:
+                (response, throttled) = self._send_limited(method, url, **kwargs)
+            except requests.exceptions.RequestException as e:
+                error = e
+            except BaseException:
+                if self.circuitBreaker is not None:
+                    self.circuitBreaker.record(url, False)
+                raise
+            failed = error is not None or response.status_code >= 500
+            if self.circuitBreaker is not None:
+                self.circuitBreaker.record(url, not failed)
+            # throttled responses were already retried by the rate limiter
+            if self.retryPolicy is None or attempt >= self.retryPolicy.retries or throttled or \
+                    (error is None and not self.retryPolicy.retryable(response)):
+                if error is not None:
+                    raise error
+                return response
+            if response is not None:
+                response.close()
+            time.sleep(self.retryPolicy.delay(attempt))
+            attempt += 1
+
+    def _send_limited(self, method, url, **kwargs) -> Tuple[requests.Response, bool]:
+        if self.rateLimiter is None:
+            return (method(url, **kwargs), False)
+        attempt = 0
+        while True:
+            self.rateLimiter.acquire(url)
+            response = None
+            try:
+                response = method(url, **kwargs)
+            finally:
+                throttled = self.rateLimiter.release(url, response)
+            if not throttled or attempt >= self.rateLimiter.maxRetries:
+                return (response, throttled)
+            response.close()
+            attempt += 1
+
+    def get(self, url, params=None, **kwargs) -> requests.Response:
+        """ HTTP GET request via the pooled connections
+
+        Parameters
+        ----------
+        url: str
+            URL to be requested
+        params: dict, optional
+            Query parameters of the request
+        kwargs: dict
+            Further arguments handed over to requests
+
+        Returns
+        -------
+        requests.Response
+        """
+        kwargs = self._kwargs(kwargs)
+        headers = dict(kwargs.pop("headers", None) or {})
+        if self.cache is not None and self.cache.offline and "Range" in headers:
+            raise NotCachedException("{} cannot be requested partially (offline mode)".format(url))
+        if self.cache is None or "Range" in headers:
+            return self._send(self.session.get, url, params=params, headers=headers, **kwargs)
+        key = self.cache.key(url, params)
+        stream = kwargs.get("stream", False)
+        entry = self.cache.lookup(key)
+        if self.cache.offline:
+            if entry is None:
+                raise NotCachedException("{} is not cached (offline mode)".format(url))
+            return self.cache.response(key, entry, stream)
+        if entry is not None:
+            headers.update(self.cache.validators(entry))
+        r = self._send(self.session.get, url, params=params, headers=headers, **kwargs)
+        if r.status_code == 304 and entry is not None:
+            r.close()
+            return self.cache.response(key, entry, stream)
+        if r.status_code == 200:
+            return self.cache.store(key, r, stream)
+        return r
+
+    def head(self, url, **kwargs) -> requests.Response:
+        """ HTTP HEAD request via the pooled connections
+
+        Parameters
+        ----------
+        url: str
+            URL to be requested
+        kwargs: dict
+            Further arguments handed over to requests
+
+        Returns
+        -------
+        requests.Response
+        """
+        if self.cache is not None and self.cache.offline:
+            key = self.cache.key(url)
+            entry = self.cache.lookup(key)
+            if entry is None:
+                raise NotCachedException("{} is not cached (offline mode)".format(url))
+            return self.cache.head(key, entry)
+        return self._send(self.session.head, url, **self._kwargs(kwargs))
+
+    def close(self) -> None:
+        """ Closes all pooled connections
+        """
+        self.session.close()
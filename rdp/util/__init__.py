@@ -1,6 +1,12 @@
+import hashlib
+import io
 import os
 import tempfile
-from typing import Callable
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Generator, Iterable, Union
 
 
 class Bundle(object):
@@ -36,6 +42,85 @@ class Bundle(object):
     def has(self, itemType):
         return itemType in self.payload.keys()
 
+class LRUCache(object):
+    """ Thread-safe in-memory cache with least-recently-used eviction and
+        an optional time to live for its entries
+
+        Parameters
+        ----------
+        maxSize: int, optional
+            Maximum number of entries, the least recently used entry is evicted
+            when the cache is full
+        ttl: float, optional
+            Time to live (in seconds) of an entry, None means entries never expire
+
+        Attributes
+        ----------
+        hits: int
+            Number of successful lookups
+        misses: int
+            Number of lookups of absent or expired entries
+    """
+    def __init__(self, maxSize=1024, ttl=None):
+        self.maxSize = maxSize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        with self._lock:
+            return self._lookup(key) is not None
+
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def get(self, key, default=None) -> Any:
+        """ Returns the value cached for key (default if absent or expired)
+        """
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value) -> None:
+        """ Caches value for key (evicting the least recently used entry if needed)
+        """
+        expires = None if self.ttl is None else time.monotonic() + self.ttl
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxSize:
+                self._entries.popitem(last=False)
+
+    def remove(self, key) -> None:
+        """ Removes the entry for key (if any)
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        """ Removes all entries and resets the counters
+        """
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
 class LazyFile(object):
     """ A lazy file is only downloaded if it its contents are accessed
         (i.e. if its loc property is accessed).
@@ -46,18 +131,54 @@ class LazyFile(object):
         loc: str
             Temporary path to which the file is downloaded. This automatically
             happens when loc is accessed for the first time.
+        digest: str
+            Verified checksum (e.g. md5:...) of the downloaded file, None if the
+            file has not been downloaded or no checksum was given
+        inMemory: bool
+            True if the file is held in memory (see memoryThreshold)
     """
-    def __init__(self, source: str, download: Callable[[str], bytes]):
+    def __init__(self, source: str, download: Callable[[str], Union[bytes, Iterable[bytes]]],
+                 size: int = None, resumable: bool = False, resumeAttempts: int = 3,
+                 checksum: str = None, store=None, memoryThreshold: int = None):
         """
         Attributes
         ----------
             source: String identifying source to download file from
-            download: Callable accepting a source information and returning bytes
+            download: Callable accepting a source information and returning
+                either bytes or an iterable yielding chunks of bytes (the
+                latter is written chunk by chunk, keeping memory bounded)
+            size: Expected size of the file in bytes (optional), the download
+                is validated against it
+            resumable: If True, download also accepts an offset (second
+                argument) and yields the bytes of the file starting at offset.
+                Interrupted downloads are then continued instead of restarted.
+            resumeAttempts: Number of times an interrupted download is resumed
+                before giving up (the partial file is kept for a later call)
+            checksum: Expected checksum as algorithm:hexdigest (e.g. md5:...),
+                verified while the file is written
+            store: BlobStore (optional) shared by LazyFiles; if given, loc
+                points into the store and the file is downloaded only if the
+                store does not hold it yet
+            memoryThreshold: Files up to this size (in bytes) are kept in
+                memory and exposed via open(); larger files spill to a
+                temporary file (None keeps all files on disk)
         """
 
         self.source = source
         self._download = download
+        self.size = size
+        self.resumable = resumable
+        self.resumeAttempts = resumeAttempts
+        self.checksum = checksum
+        self.digest = None
         self._loc = None
+        self._partial = None
+        self._hash = None
+        self._lock = threading.RLock()
+        self.store = store
+        self._reference = None
+        self.memoryThreshold = memoryThreshold
+        self._content = None
 
     def __del__(self):
         self.remove()
@@ -65,20 +186,223 @@ class LazyFile(object):
     @property
     def loc(self):
         """ Location of file - accessing this attribute lazily downloads the file
+            (waiting for a download already running in another thread)
         """
-        if self._loc is None:
-            self.download()
-        return self._loc
+        with self._lock:
+            if self._loc is None:
+                if self._content is None:
+                    self.download()
+                if self._content is not None:
+                    # consumers needing a path get the in-memory file spilled to disk
+                    (fd, self._loc) = tempfile.mkstemp(suffix=self.source.split("/")[-1])
+                    with os.fdopen(fd, "wb") as f:
+                        f.write(self._content)
+            return self._loc
 
-    def download(self) -> None:
-        """ Downloads the file to loc
+    @property
+    def inMemory(self) -> bool:
+        return self._content is not None
+
+    def open(self) -> io.BufferedIOBase:
+        """ Opens the file for binary reading (downloading it if necessary).
+            Files held in memory are exposed as a BytesIO sharing their buffer.
         """
-        (fd, self._loc) = tempfile.mkstemp(suffix=self.source.split("/")[-1])
-        os.write(fd, self._download(self.source))
-        os.close(fd)
+        with self._lock:
+            if self._loc is None and self._content is None:
+                self.download()
+            if self._content is not None:
+                return io.BytesIO(self._content)
+            return open(self._loc, "rb")
 
-    def remove(self) -> None:
-        """ Removes the file stored at loc
+    def _chunks(self, offset=0) -> Iterable[bytes]:
+        if offset > 0:
+            content = self._download(self.source, offset)
+        else:
+            content = self._download(self.source)
+        if isinstance(content, (bytes, bytearray)):
+            content = [ content ]
+        return content
+
+    def _fetch(self, f, offset) -> None:
+        for chunk in self._chunks(offset):
+            f.write(chunk)
+            if self._hash is not None:
+                self._hash.update(chunk)
+
+    def download(self) -> None:
+        """ Downloads the file to loc. If the file was partially downloaded
+            before and the download is resumable, the download continues at
+            the end of the partial file.
         """
+        with self._lock:
+            self._download_locked()
+
+    def _download_locked(self) -> None:
+        if self.memoryThreshold is not None and self.store is None and self._partial is None \
+                and (self.size is None or self.size <= self.memoryThreshold):
+            attempt = 0
+            while True:
+                try:
+                    return self._download_memory()
+                except Exception:
+                    attempt += 1
+                    if self._partial is not None or not self.resumable or \
+                            attempt > self.resumeAttempts:
+                        raise
+        if self.store is not None:
+            key = self.store.key(self.source, self.checksum)
+            (loc, reference) = self.store.acquire(key, self._download_file)
+            self._release()
+            (self._loc, self._reference) = (loc, reference)
+            if self.checksum is not None:
+                # the store only holds files whose checksum has been verified
+                self.digest = self.checksum
+            return
+        loc = self._download_file()
         if self._loc is not None:
             os.unlink(self._loc)
+        self._loc = loc
+
+    def _download_memory(self) -> None:
+        self._hash = hashlib.new(self.checksum.split(":", 1)[0]) if self.checksum else None
+        buffer = io.BytesIO()
+        chunks = iter(self._chunks())
+        for chunk in chunks:
+            if buffer.tell() + len(chunk) > self.memoryThreshold:
+                # larger than expected: continue on disk (resumable from there)
+                (fd, self._partial) = tempfile.mkstemp(suffix=self.source.split("/")[-1])
+                with os.fdopen(fd, "wb") as f:
+                    f.write(buffer.getbuffer())
+                    f.write(chunk)
+                    if self._hash is not None:
+                        self._hash.update(chunk)
+                    for chunk in chunks:
+                        f.write(chunk)
+                        if self._hash is not None:
+                            self._hash.update(chunk)
+                self._loc = self._complete_partial()
+                return
+            buffer.write(chunk)
+            if self._hash is not None:
+                self._hash.update(chunk)
+        self._verify(buffer.tell())
+        self._content = buffer.getvalue()
+
+    def _verify(self, received) -> None:
+        if self.size is not None and received != self.size:
+            self._hash = None
+            raise IOError("Download of {} is incomplete: expected {} bytes, received {}".format(
+                self.source, self.size, received))
+        if self._hash is not None:
+            digest = "{}:{}".format(self._hash.name, self._hash.hexdigest())
+            self._hash = None
+            if digest != self.checksum:
+                raise IOError("Checksum of {} does not match: expected {}, computed {}".format(
+                    self.source, self.checksum, digest))
+            self.digest = digest
+
+    def _download_file(self, directory=None) -> str:
+        if self._partial is None:
+            (fd, self._partial) = tempfile.mkstemp(
+                suffix=self.source.split("/")[-1], dir=directory)
+            os.close(fd)
+        attempt = 0
+        while True:
+            offset = os.path.getsize(self._partial) if self.resumable else 0
+            if offset == 0 and self.checksum is not None:
+                self._hash = hashlib.new(self.checksum.split(":", 1)[0])
+            if self.size is not None and offset == self.size:
+                break
+            try:
+                with open(self._partial, "ab" if offset > 0 else "wb") as f:
+                    self._fetch(f, offset)
+                break
+            except Exception:
+                attempt += 1
+                if not self.resumable or attempt > self.resumeAttempts:
+                    raise
+        return self._complete_partial()
+
+    def _complete_partial(self) -> str:
+        try:
+            self._verify(os.path.getsize(self._partial))
+        except IOError:
+            self._discard()
+            raise
+        (loc, self._partial) = (self._partial, None)
+        return loc
+
+    def _discard(self) -> None:
+        os.unlink(self._partial)
+        (self._partial, self._hash) = (None, None)
+
+    def _release(self) -> None:
+        if self._reference is not None:
+            self.store.release(self._reference)
+        elif self._loc is not None and os.path.exists(self._loc):
+            os.unlink(self._loc)
+        (self._loc, self._reference) = (None, None)
+
+    def remove(self) -> None:
+        """ Removes the file stored at loc (files in a store are only released)
+        """
+        self._release()
+        if self._partial is not None and os.path.exists(self._partial):
+            os.unlink(self._partial)
+        self._partial = None
+        self._content = None
+
+def _prefetch_file(lazyFile: LazyFile) -> None:
+    # downloads without forcing files held in memory to disk (unlike loc)
+    with lazyFile._lock:
+        if lazyFile._loc is None and lazyFile._content is None:
+            lazyFile.download()
+
+def prefetch(items: Iterable, window: int = 2, maxWorkers: int = 2,
+             maxBytes: int = None) -> Generator[Any, None, None]:
+    """ Yields the given items while the files (LazyFile in the file attribute)
+        of the next items are downloaded in the background
+
+        Parameters
+        ----------
+        items: Iterable
+            Items (e.g. Data objects) to iterate over
+        window: int, optional
+            Number of items ahead of the current one whose files are prefetched
+        maxWorkers: int, optional
+            Maximum number of concurrent downloads
+        maxBytes: int, optional
+            Maximum number of bytes prefetched but not yet handed out (only
+            files of known size are counted; None means no limit)
+    """
+    items = iter(items)
+    ahead = deque()
+    held = 0
+    executor = ThreadPoolExecutor(max_workers=max(1, maxWorkers))
+    try:
+        while True:
+            while len(ahead) <= window:
+                try:
+                    ahead.append([next(items), None, 0])
+                except StopIteration:
+                    break
+            if len(ahead) == 0:
+                return
+            for entry in ahead:
+                lazyFile = getattr(entry[0], "file", None)
+                if entry[1] is not None or not isinstance(lazyFile, LazyFile):
+                    continue
+                size = lazyFile.size or 0
+                if maxBytes is not None and held + size > maxBytes:
+                    break
+                entry[1] = executor.submit(_prefetch_file, lazyFile)
+                entry[2] = size
+                held += size
+            (item, future, size) = ahead.popleft()
+            held -= size
+            yield item
+    finally:
+        for entry in ahead:
+            if entry[1] is not None:
+                entry[1].cancel()
+        executor.shutdown(wait=False)
@@ -0,0 +1,146 @@
+################################################################################
+# Copyright: Tobias Weber 2020
+#
+# Apache 2.0 License
+#
+# This file contains all code related to the local store for downloaded files
+#
+################################################################################
+import fcntl
+import hashlib
+import os
+import uuid
+from contextlib import contextmanager
+from typing import Callable, Tuple
+
+class BlobStore(object):
+    """ Content-addressed local store for downloaded files, shared by all
+        LazyFiles (and processes) using the same directory
+
+        Summary
+        -------
+        Files are stored under a key derived from their checksum (or their
+        source if no checksum is known), so each file is downloaded once and
+        survives restarts. Processes coordinate via file locks. Every user of
+        a file holds a reference; when the total size exceeds maxSize, the
+        least recently used unreferenced files are evicted.
+
+        Parameters
+        ----------
+        directory: str
+            Directory of the store (created if missing)
+        maxSize: int, optional
+            Quota (in bytes) for the total size of all stored files
+
+        Methods
+        -------
+        key(source, checksum=None) -> str
+            Key of a file in the store
+        acquire(key, fetch) -> Tuple[str, str]
+            Path of the stored file (fetched if missing) and a reference to it
+        release(reference) -> None
+            Releases a reference handed out by acquire
+    """
+    def __init__(self, directory, maxSize=10737418240):
+        self.directory = directory
+        self.maxSize = maxSize
+        for sub in ("blobs", "refs", "locks", "tmp"):
+            os.makedirs(os.path.join(directory, sub), exist_ok=True)
+
+    @contextmanager
+    def _locked(self, name):
+        with open(os.path.join(self.directory, "locks", "{}.lock".format(name)), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def key(self, source, checksum=None) -> str:
+        """ Key of a file in the store
+        """
+        if checksum:
+            return checksum.replace(":", "-", 1)
+        return "url-{}".format(hashlib.sha256(source.encode("utf-8")).hexdigest())
+
+    def path(self, key) -> str:
+        """ Path of the file stored under key (which may not exist)
+        """
+        return os.path.join(self.directory, "blobs", key)
+
+    def acquire(self, key, fetch: Callable[[str], str]) -> Tuple[str, str]:
+        """ Returns the path of the file stored under key and a reference to it.
+            Missing files are fetched first (once, even if several processes
+            acquire them at the same time).
+
+        Parameters
+        ----------
+        key: str
+            Key of the file
+        fetch: Callable
+            Called with a temporary directory on the same file system as the
+            store, must return the path of the downloaded file
+
+        Returns
+        -------
+        Tuple[str, str]
+            Path of the stored file and the reference to release later
+        """
+        path = self.path(key)
+        with self._locked(key):
+            if os.path.exists(path):
+                os.utime(path)
+            else:
+                os.replace(fetch(os.path.join(self.directory, "tmp")), path)
+            reference = os.path.join(self.directory, "refs", "{}.{}.{}".format(
+                key, os.getpid(), uuid.uuid4().hex))
+            open(reference, "w").close()
+        self._evict()
+        return (path, reference)
+
+    def release(self, reference) -> None:
+        """ Releases a reference handed out by acquire
+        """
+        if os.path.exists(reference):
+            os.unlink(reference)
+
+    def size(self) -> int:
+        """ Total size (in bytes) of all stored files
+        """
+        blobs = os.path.join(self.directory, "blobs")
+        return sum(os.path.getsize(os.path.join(blobs, b)) for b in os.listdir(blobs))
+
+    def _referenced(self, key) -> bool:
+        refs = os.path.join(self.directory, "refs")
+        referenced = False
+        for name in os.listdir(refs):
+            if not name.startswith("{}.".format(key)):
+                continue
+            pid = name[len(key) + 1:].split(".")[0]
+            try:
+                os.kill(int(pid), 0)
+            except ProcessLookupError:
+                # stale reference of a process which did not release it
+                os.unlink(os.path.join(refs, name))
+                continue
+            except PermissionError:
+                pass
+            referenced = True
+        return referenced
+
+    def _evict(self) -> None:
+        with self._locked("store"):
+            blobs = os.path.join(self.directory, "blobs")
+            entries = []
+            for key in os.listdir(blobs):
+                stat = os.stat(os.path.join(blobs, key))
+                entries.append((stat.st_mtime, stat.st_size, key))
+            total = sum(e[1] for e in entries)
+            for (mtime, size, key) in sorted(entries):
+                if total <= self.maxSize:
+                    break
+                with self._locked(key):
+                    if self._referenced(key):
+                        continue
+                    os.unlink(os.path.join(blobs, key))
+                total -= size
@@ -16,5 +16,5 @@ setup(
     url='https://github.com/tgweber/rdp',
     license=license,
     packages=find_packages(exclude=('tests', 'docs')),
-    install_requires=["xmltodict", "requests", "textract"]
+    install_requires=["xmltodict", "requests", "textract", "pdfminer.six"]
 )
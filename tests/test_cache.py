@@ -0,0 +1,94 @@
+################################################################################
+# Copyright: Tobias Weber 2020
+#
+# Apache 2.0 License
+#
+# This file contains all cache-related tests
+#
+################################################################################
+from unittest import mock
+import pytest
+
+from util import _MockResponse
+from rdp.exceptions import NotCachedException
+from rdp.services.cache import HttpCache
+from rdp.services.session import HttpSession
+
+def mocked_conditional_get(*args, **kwargs):
+    if kwargs["headers"].get("If-None-Match") == "\"v1\"":
+        return _MockResponse(b"", 304)
+    return _MockResponse(b"x" * 100, 200, {"ETag": "\"v1\""})
+
+@mock.patch('requests.Session.get', side_effect=mocked_conditional_get)
+def test_cache_revalidation(mock_get, tmp_path):
+    session = HttpSession(cache=HttpCache(str(tmp_path)))
+    r = session.get("https://zenodo.org/api/a", {"q": "1"})
+    assert r.content == b"x" * 100
+    assert "If-None-Match" not in mock_get.call_args[1]["headers"]
+    r = session.get("https://zenodo.org/api/a", {"q": "1"})
+    assert mock_get.call_args[1]["headers"]["If-None-Match"] == "\"v1\""
+    assert r.status_code == 200
+    assert r.headers["ETag"] == "\"v1\""
+    assert r.content == b"x" * 100
+    session.cache.offline = True
+    assert session.get("https://zenodo.org/api/a", {"q": "1"}).content == b"x" * 100
+    assert mock_get.call_count == 2
+    with pytest.raises(NotCachedException):
+        session.get("https://zenodo.org/api/b")
+
+@mock.patch('requests.Session.get', side_effect=mocked_conditional_get)
+def test_cache_eviction(mock_get, tmp_path):
+    cache = HttpCache(str(tmp_path), maxSize=250)
+    session = HttpSession(cache=cache)
+    for i in range(4):
+        session.get("https://zenodo.org/api/{}".format(i)).close()
+    assert cache.size() == 200
+    assert cache.lookup(cache.key("https://zenodo.org/api/0")) is None
+    assert cache.lookup(cache.key("https://zenodo.org/api/3")) is not None
+
+def mocked_large_get(*args, **kwargs):
+    if args[0].endswith("/announced"):
+        return _MockResponse(b"y" * 300, 200, {"Content-Length": "300"})
+    return _MockResponse(b"y" * 300000, 200, {})
+
+@mock.patch('requests.Session.get', side_effect=mocked_large_get)
+def test_cache_large_bodies(mock_get, tmp_path):
+    cache = HttpCache(str(tmp_path), maxSize=250)
+    session = HttpSession(cache=cache)
+    assert session.get("https://zenodo.org/api/announced").content == b"y" * 300
+    assert session.get("https://zenodo.org/api/unannounced").content == b"y" * 300000
+    with session.get("https://zenodo.org/api/streamed", stream=True) as r:
+        assert b"".join(r.iter_content(1000)) == b"y" * 300000
+    assert cache.size() == 0
+    assert [n for n in tmp_path.iterdir() if n.suffix == ".tmp"] == []
+
+@mock.patch('requests.Session.get', side_effect=mocked_conditional_get)
+def test_cache_streamed(mock_get, tmp_path):
+    cache = HttpCache(str(tmp_path))
+    session = HttpSession(cache=cache)
+    key = cache.key("https://zenodo.org/api/a")
+    # an incompletely consumed body is not cached
+    with session.get("https://zenodo.org/api/a", stream=True) as r:
+        assert next(r.iter_content(10)) == b"x" * 10
+        assert cache.lookup(key) is None
+    assert cache.lookup(key) is None
+    with session.get("https://zenodo.org/api/a", stream=True) as r:
+        assert b"".join(r.iter_content(10)) == b"x" * 100
+    assert cache.lookup(key) is not None
+    assert cache.size() == 100
+
+@mock.patch('requests.Session.head')
+@mock.patch('requests.Session.get', side_effect=mocked_conditional_get)
+def test_cache_offline(mock_get, mock_head, tmp_path):
+    session = HttpSession(cache=HttpCache(str(tmp_path)))
+    session.get("https://zenodo.org/api/a")
+    session.cache.offline = True
+    r = session.head("https://zenodo.org/api/a")
+    assert r.status_code == 200
+    assert r.headers["ETag"] == "\"v1\""
+    with pytest.raises(NotCachedException):
+        session.head("https://zenodo.org/api/b")
+    with pytest.raises(NotCachedException):
+        session.get("https://zenodo.org/api/a", headers={"Range": "bytes=10-"})
+    assert mock_head.call_count == 0
+    assert mock_get.call_count == 1
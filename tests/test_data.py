@@ -0,0 +1,254 @@
+################################################################################
+# Copyright: Tobias Weber 2020
+#
+# Apache 2.0 License
+#
+# This file contains all data-related tests
+#
+################################################################################
+import os
+from datetime import datetime
+
+from textract import process
+from textract.exceptions import ShellError
+
+from rdp.data import columns, CSVData, FileData, FileDataFactory, PDFData
+from rdp.data.cache import TextCache
+from rdp.util import LazyFile
+
+def _read(path):
+    def download(source):
+        with open(path, "rb") as f:
+            return f.read()
+    return download
+
+def test_csv_in_memory():
+    lf = LazyFile("http://example.com/d001.csv", _read("./tests/artefacts/d001.csv"),
+                  memoryThreshold=1048576)
+    csv = FileDataFactory.create(lf)
+    assert isinstance(csv, CSVData)
+    assert csv.header[0] == "date"
+    assert len(csv.rows) == 86
+    assert csv.rows[2]["model"] == "MLPClassifier"
+    assert lf.inMemory
+    assert lf._loc is None
+
+def test_pdf_in_memory():
+    lf = LazyFile("http://example.com/md001.pdf", _read("./tests/artefacts/md001.pdf"),
+                  memoryThreshold=1048576)
+    pdf = FileDataFactory.create(lf)
+    assert isinstance(pdf, PDFData)
+    assert pdf.numPages == 11
+    assert lf.inMemory
+
+def test_csv_iter_rows():
+    lf = LazyFile("http://example.com/d001.csv", _read("./tests/artefacts/d001.csv"),
+                  memoryThreshold=1048576)
+    csv = FileDataFactory.create(lf)
+    rows = csv.iter_rows()
+    assert not isinstance(rows, list)
+    assert sum(1 for _ in rows) == 86
+    projected = list(csv.iter_rows(columns=["model", "date"], skip=2, limit=3, asDict=False))
+    assert len(projected) == 3
+    assert projected[0] == ("MLPClassifier", "2019-09-23T13:20:35.232552")
+    assert list(csv.iter_rows(columns=["model"], skip=2, limit=1)) == [{"model": "MLPClassifier"}]
+    assert csv._rows is None
+    try:
+        next(csv.iter_rows(columns=["nope"]))
+        assert False
+    except KeyError:
+        pass
+
+def test_csv_columns():
+    lf = LazyFile("http://example.com/d001.csv", _read("./tests/artefacts/d001.csv"),
+                  memoryThreshold=1048576)
+    csv = FileDataFactory.create(lf)
+    assert csv.columns["date"].dtype == columns.DATE
+    assert csv.columns["fone_0"].dtype == columns.FLOAT
+    assert csv.columns["model"].dtype == columns.STRING
+    assert len(csv.columns["fone_0"]) == 86
+    stats = csv.statistics()
+    assert stats["fone_0"]["min"] == 0.0
+    assert abs(stats["fone_0"]["mean"] - 0.5278651844856643) < 1e-9
+    assert stats["date"]["min"] == datetime(2019, 9, 22, 14, 41, 9, 432106)
+    assert stats["model"]["mean"] is None
+
+def test_column_inference(monkeypatch):
+    for numpy in (columns.numpy, None):
+        monkeypatch.setattr(columns, "numpy", numpy)
+        ints = columns.create_column("a", ["1", "2", "3"])
+        assert ints.dtype == columns.INT
+        assert ints.statistics() == {"min": 1, "max": 3, "mean": 2.0, "nulls": 0}
+        withNulls = columns.create_column("b", ["1", "", "3"])
+        assert withNulls.dtype == columns.FLOAT
+        assert withNulls.statistics() == {"min": 1.0, "max": 3.0, "mean": 2.0, "nulls": 1}
+        # values beyond the inferred sample widen the type
+        assert columns.create_column("c", ["1", "2", "x"], sample=2).dtype == columns.STRING
+        assert columns.create_column("d", ["", ""]).statistics()["nulls"] == 2
+        # numbers are never read as dates
+        assert columns.create_column("e", ["1", "2019-01-01"]).dtype == columns.STRING
+        assert columns.create_column("f", ["2019-01-01", "1"]).dtype == columns.STRING
+        # integers beyond int64 widen the column instead of failing
+        big = columns.create_column("g", ["1", "12345678901234567890123"], sample=1)
+        assert big.dtype == columns.FLOAT
+        assert columns.infer_type(["12345678901234567890123"]) == columns.FLOAT
+
+def test_csv_columns_int_overflow():
+    csv = CSVData(LazyFile("http://example.com/a.csv",
+                           lambda s: b"id,v\n1,2\n12345678901234567890123,3\n"))
+    assert csv.columns["id"].dtype == columns.FLOAT
+    assert csv.statistics()["id"]["max"] == 12345678901234567890123.0
+
+def test_build_columns_batches(monkeypatch):
+    batches = [
+        [["1", "2"], ["1.5", "2"], ["2020-01-01", ""], ["a", "b"]],
+        [["", "4"], ["x", "3"], ["2020-01-03T12:00:00+02:00", "2020-01-02"], ["", "c"]],
+    ]
+    for numpy in (columns.numpy, None):
+        monkeypatch.setattr(columns, "numpy", numpy)
+        calls = []
+        def source(types):
+            calls.append(None)
+            return iter(batches)
+        built = columns.build_columns(["i", "f", "d", "s"], source)
+        # the null widens the int column in place, "x" forces a rebuild
+        assert len(calls) == 2
+        assert built["i"].dtype == columns.FLOAT
+        assert built["i"].statistics() == {"min": 1.0, "max": 4.0, "mean": 7 / 3, "nulls": 1}
+        assert built["f"].dtype == columns.STRING
+        assert list(built["f"].values) == ["1.5", "2", "x", "3"]
+        assert built["d"].dtype == columns.DATE
+        stats = built["d"].statistics()
+        assert stats["nulls"] == 1
+        assert stats["min"] == datetime(2020, 1, 1)
+        assert stats["max"] == datetime(2020, 1, 3, 10)
+        assert built["s"].statistics()["nulls"] == 1
+        assert len(built["s"]) == 4
+        assert columns.build_columns(["e"], lambda types: iter([]))["e"].statistics()["nulls"] == 0
+
+def test_pdf_lazy():
+    calls = []
+    def download(source):
+        calls.append(source)
+        return _read("./tests/artefacts/md001.pdf")(source)
+    lf = LazyFile("http://example.com/md001.pdf", download)
+    pdf = FileDataFactory.create(lf)
+    assert calls == []
+    assert pdf.numPages == 11
+    assert pdf.numPages == 11
+    assert len(calls) == 1
+    lf.remove()
+
+def test_text_cache(tmp_path, monkeypatch):
+    calls = []
+    extractions = []
+    def download(source):
+        calls.append(source)
+        return _read("./tests/artefacts/md001.pdf")(source)
+    def counting_process(path):
+        extractions.append(path)
+        return process(path)
+    monkeypatch.setattr("rdp.data.process", counting_process)
+    checksum = "md5:037c8d56988886e7209f45abe0855a9a"
+    cache = TextCache(str(tmp_path))
+    first = FileDataFactory.create(
+        LazyFile("http://example.com/md001.pdf", download, checksum=checksum), cache)
+    text = first.text
+    assert "introduction" in text.lower()
+    assert first.text == text
+    assert len(extractions) == 1
+    # same file in another RDP (or run) is neither downloaded nor extracted again
+    second = FileDataFactory.create(
+        LazyFile("http://mirror.example.com/md001.pdf", download, checksum=checksum),
+        TextCache(str(tmp_path)))
+    assert second.text == text
+    assert len(extractions) == 1
+    assert len(calls) == 1
+    # a new extractor version invalidates the cache
+    third = FileDataFactory.create(
+        LazyFile("http://example.com/md001.pdf", download, checksum=checksum),
+        TextCache(str(tmp_path), version="other"))
+    assert third.text == text
+    assert len(extractions) == 2
+
+def test_text_in_memory():
+    lf = LazyFile("http://example.com/a.dat", lambda s: b"plain text", memoryThreshold=1024)
+    assert FileData(lf).text == "plain text"
+    # files textract cannot handle are read without being written to disk
+    assert lf.inMemory
+    assert lf._loc is None
+
+def test_text_cache_without_checksum(tmp_path):
+    cache = TextCache(str(tmp_path))
+    first = FileData(LazyFile("http://example.com/a.dat", lambda s: b"some text"), cache)
+    assert first.text == "some text"
+    assert len(os.listdir(str(tmp_path))) == 1
+
+def test_pdf_iter_pages():
+    lf = LazyFile("http://example.com/md001.pdf", _read("./tests/artefacts/md001.pdf"))
+    pdf = FileDataFactory.create(lf)
+    pages = pdf.iter_pages()
+    first = next(pages)
+    assert "\f" not in first
+    pages = [first] + list(pages)
+    assert len(pages) == pdf.numPages
+    assert "\f".join(pages) + "\f" == pdf.text
+    assert list(pdf.iter_pages(2, 4)) == pages[2:4]
+    assert list(pdf.iter_pages(4, 4)) == []
+
+def test_pdf_iter_pages_pdftotext(tmp_path, monkeypatch):
+    script = tmp_path / "pdftotext"
+    script.write_text("#!/bin/sh\nprintf 'T  ITLES one\\fpage two\\f'\n")
+    script.chmod(0o755)
+    monkeypatch.setenv("PATH", "{}:{}".format(tmp_path, os.environ["PATH"]))
+    lf = LazyFile("http://example.com/md001.pdf", _read("./tests/artefacts/md001.pdf"))
+    assert list(FileDataFactory.create(lf).iter_pages()) == ["TITLES one", "page two"]
+
+def test_pdf_iter_pages_pdftotext_fails(tmp_path, monkeypatch):
+    script = tmp_path / "pdftotext"
+    script.write_text("#!/bin/sh\nprintf 'page one\\f'\necho 'Syntax Error: broken' >&2\nexit 1\n")
+    script.chmod(0o755)
+    monkeypatch.setenv("PATH", "{}:{}".format(tmp_path, os.environ["PATH"]))
+    pdf = FileDataFactory.create(LazyFile("http://example.com/md001.pdf",
+                                          _read("./tests/artefacts/md001.pdf")))
+    pages = pdf.iter_pages()
+    assert next(pages) == "page one"
+    try:
+        next(pages)
+        assert False
+    except ShellError as e:
+        assert e.exit_code == 1
+        assert "Syntax Error" in e.stderr
+    try:
+        pdf.extract_pages(maxWorkers=2)
+        assert False
+    except ShellError as e:
+        assert e.exit_code == 1
+
+def test_pdf_extract_pages():
+    lf = LazyFile("http://example.com/md001.pdf", _read("./tests/artefacts/md001.pdf"))
+    pdf = FileDataFactory.create(lf)
+    pages = list(pdf.iter_pages())
+    assert pdf.extract_pages(maxWorkers=3) == pages
+    assert pdf.extract_pages(maxWorkers=2, pagesPerRange=4) == pages
+    parallel = PDFData(LazyFile("http://example.com/md001.pdf", _read("./tests/artefacts/md001.pdf")),
+                       maxWorkers=2)
+    assert parallel.text == pdf.text
+
+def test_pdf_parallel_text_normalised_as_whole(tmp_path, monkeypatch):
+    script = tmp_path / "pdftotext"
+    script.write_text(
+        "#!/bin/sh\nfirst=1; last=11\n"
+        "while [ $# -gt 0 ]; do case \"$1\" in -f) first=$2; shift;; -l) last=$2; shift;; esac; shift; done\n"
+        "i=$first\nwhile [ $i -le $last ]; do\n"
+        "  if [ $i -eq 1 ]; then printf 'one A\\f'; elif [ $i -eq 2 ]; then printf 'BCDEFG two\\f';\n"
+        "  else printf 'page %s\\f' $i; fi\n  i=$((i+1))\ndone\n")
+    script.chmod(0o755)
+    monkeypatch.setenv("PATH", "{}:{}".format(tmp_path, os.environ["PATH"]))
+    sequential = PDFData(LazyFile("http://example.com/md001.pdf", _read("./tests/artefacts/md001.pdf")))
+    parallel = PDFData(LazyFile("http://example.com/md001.pdf", _read("./tests/artefacts/md001.pdf")),
+                       maxWorkers=2)
+    # the capital letter is joined across the page break in text only
+    assert sequential.text.startswith("one ABCDEFG two\f")
+    assert parallel.text == sequential.text
+    assert parallel.extract_pages(maxWorkers=2)[:2] == ["one A", "BCDEFG two"]
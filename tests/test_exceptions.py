@@ -14,7 +14,8 @@ from rdp.exceptions import \
         CannotCreateMetadataException
 from rdp.services import OaipmhService
 
-def test_cannot_create_exceptions():
+@mock.patch('requests.Session.get', side_effect=mocked_requests_get)
+def test_cannot_create_exceptions(mock_get):
     oaipmh = OaipmhService("https://zenodo.org/oai2d", "oai:zenodo.org:")
     with pytest.raises(CannotCreateRDPException) as e:
         md = oaipmh.get_metadata("exception1", "datacite")
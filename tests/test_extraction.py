@@ -0,0 +1,95 @@
+################################################################################
+# Copyright: Tobias Weber 2020
+#
+# Apache 2.0 License
+#
+# This file contains all extraction-related tests
+#
+################################################################################
+import os
+import time
+
+import pytest
+
+from rdp.data import FileData, FileDataFactory, extract_text
+from rdp.data.cache import TextCache
+from rdp.data.extraction import extract_texts
+from rdp.util import LazyFile
+
+def _content(content):
+    return lambda source: content
+
+def _pdf(source):
+    with open("./tests/artefacts/md001.pdf", "rb") as f:
+        return f.read()
+
+def _running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    try:
+        # killed orphans stay zombies if nobody reaps them (e.g. in containers)
+        with open("/proc/{}/stat".format(pid)) as f:
+            return f.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except OSError:
+        return True
+
+def test_extract_texts():
+    items = [FileData(LazyFile("http://example.com/{}.dat".format(i), _content(str(i).encode())))
+             for i in range(5)]
+    pdf = FileDataFactory.create(LazyFile("http://example.com/md001.pdf", _pdf))
+    results = dict((d.file.source, t) for (d, t) in extract_texts([items[:3], [items[3:], pdf]],
+                                                                  maxWorkers=3))
+    assert len(results) == 6
+    assert results["http://example.com/4.dat"] == "4"
+    assert "introduction" in results["http://example.com/md001.pdf"].lower()
+    # texts are kept by the data objects
+    assert pdf.cached_text() == (True, results["http://example.com/md001.pdf"])
+    assert pdf.text == results["http://example.com/md001.pdf"]
+
+def test_extract_texts_cached(tmp_path, monkeypatch):
+    cache = TextCache(str(tmp_path))
+    cache.put("md5:abc", "cached text")
+    data = FileData(LazyFile("http://example.com/a.dat", _content(b"x"), checksum="md5:abc"), cache)
+    monkeypatch.setattr("rdp.data.extraction.extract_text", None)
+    assert list(extract_texts([data])) == [(data, "cached text")]
+
+def test_extract_texts_timeout(monkeypatch):
+    def slow(path):
+        if path.endswith(".slow"):
+            time.sleep(30)
+        return extract_text(path)
+    monkeypatch.setattr("rdp.data.extraction.extract_text", slow)
+    items = [FileData(LazyFile("http://example.com/a.slow", _content(b"a"))),
+             FileData(LazyFile("http://example.com/b.dat", _content(b"b")))]
+    start = time.monotonic()
+    results = list(extract_texts(items, maxWorkers=2, timeout=1))
+    assert time.monotonic() - start < 10
+    assert [d.file.source for (d, t) in results] == ["http://example.com/b.dat",
+                                                      "http://example.com/a.slow"]
+    assert results[0][1] == "b"
+    assert isinstance(results[1][1], TimeoutError)
+    assert items[0].cached_text() == (False, None)
+
+def test_extract_texts_timeout_kills_subprocesses(tmp_path, monkeypatch):
+    pids = tmp_path / "pids"
+    script = tmp_path / "pdftotext"
+    script.write_text("#!/bin/sh\necho $$ >> {}\nexec sleep 30\n".format(pids))
+    script.chmod(0o755)
+    monkeypatch.setenv("PATH", "{}:{}".format(tmp_path, os.environ["PATH"]))
+    pdf = FileDataFactory.create(LazyFile("http://example.com/md001.pdf", _pdf))
+    results = list(extract_texts([pdf], timeout=1))
+    assert isinstance(results[0][1], TimeoutError)
+    pid = int(pids.read_text().split()[0])
+    # the pdftotext started by textract is killed along with the worker
+    for _ in range(50):
+        if not _running(pid):
+            break
+        time.sleep(0.1)
+    else:
+        assert False, "pdftotext is still running"
+
+def test_extract_texts_rejects_strings():
+    with pytest.raises(TypeError):
+        list(extract_texts(["http://example.com/a.dat"]))
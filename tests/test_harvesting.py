@@ -0,0 +1,65 @@
+################################################################################
+# Copyright: Tobias Weber 2020
+#
+# Apache 2.0 License
+#
+# This file contains all harvesting-related tests
+#
+################################################################################
+import json
+import os
+from unittest import mock
+
+from util import mocked_requests_get
+from rdp.services import OaipmhService
+from rdp.services.harvesting import OaipmhHarvester
+
+@mock.patch('requests.Session.get', side_effect=mocked_requests_get)
+def test_harvester_resume_and_increment(mock_get, tmp_path):
+    checkpoint = str(tmp_path / "checkpoint.json")
+    oaipmh = OaipmhService("https://zenodo.org/oai2d", "oai:zenodo.org:")
+    harvester = OaipmhHarvester(oaipmh, checkpoint, setSpec="user-test")
+
+    # interrupted harvest: stops within the second page
+    records = harvester.harvest()
+    for i in range(3):
+        next(records)
+    records.close()
+    with open(checkpoint) as f:
+        state = json.load(f)
+    assert state["resumptionToken"] == "token001"
+    assert harvester.datestamp is None
+
+    # resumed harvest only requests the remaining page
+    mock_get.reset_mock()
+    records = list(harvester.harvest())
+    assert len(records) == 1
+    assert records[0].pid == "10.5282/verba-alpina/A12317_v4"
+    assert mock_get.call_args[1]["params"] == {"verb": "ListRecords", "resumptionToken": "token001"}
+    assert harvester.datestamp == "2019-11-04T07:10:24Z"
+
+    # next run is selective
+    mock_get.reset_mock()
+    list(harvester.harvest())
+    assert mock_get.call_args_list[0][1]["params"]["from"] == "2019-11-04T07:10:24Z"
+
+    harvester.reset()
+    assert not os.path.exists(checkpoint)
+
+@mock.patch('requests.Session.get', side_effect=mocked_requests_get)
+def test_harvester_expired_token(mock_get, tmp_path):
+    checkpoint = str(tmp_path / "checkpoint.json")
+    with open(checkpoint, "w") as f:
+        json.dump({"from": "2019-01-01T00:00:00Z", "until": None, "resumptionToken": "expired",
+                   "pending": "2019-11-01T07:10:24Z", "metadataPrefix": "datacite",
+                   "set": "user-test"}, f)
+    harvester = OaipmhHarvester(OaipmhService("https://zenodo.org/oai2d", "oai:zenodo.org:"),
+                                checkpoint, setSpec="user-test")
+    records = list(harvester.harvest())
+    assert len(records) > 0
+    # the window restarts at its start, not at the pending datestamp, as older
+    # records may still be on the pages not harvested yet
+    assert mock_get.call_args_list[1][1]["params"]["from"] == "2019-01-01T00:00:00Z"
+    assert harvester.datestamp == "2019-11-04T07:10:24Z"
+    with open(checkpoint) as f:
+        assert json.load(f)["resumptionToken"] is None
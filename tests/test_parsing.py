@@ -0,0 +1,69 @@
+################################################################################
+# Copyright: Tobias Weber 2020
+#
+# Apache 2.0 License
+#
+# This file contains all parsing-related tests
+#
+################################################################################
+import csv
+
+from rdp.data import columns, CSVData
+from rdp.data.parsing import parse_csv, split_csv
+from rdp.util import LazyFile
+
+def _write(path, rows):
+    with open(path, "w", newline="") as f:
+        csv.writer(f).writerows(rows)
+
+def test_split_csv_quoted_newlines(tmp_path):
+    path = str(tmp_path / "quoted.csv")
+    rows = [["id", "note"]] + [[str(i), "line\none \"{}\"\nend".format(i)] for i in range(200)]
+    _write(path, rows)
+    (header, chunks) = split_csv(path, chunkSize=64)
+    assert header == ["id", "note"]
+    assert len(chunks) > 10
+    assert all(chunks[i][1] == chunks[i + 1][0] for i in range(len(chunks) - 1))
+    parsed = [row for chunk in parse_csv(path, maxWorkers=2, chunkSize=64) for row in chunk]
+    assert parsed == rows[1:]
+
+def test_csv_parallel():
+    def download(source):
+        with open("./tests/artefacts/d001.csv", "rb") as f:
+            return f.read()
+    sequential = CSVData(LazyFile("http://example.com/d001.csv", download))
+    parallel = CSVData(LazyFile("http://example.com/d001.csv", download),
+                       maxWorkers=2, chunkSize=4096)
+    assert list(parallel.iter_rows()) == list(sequential.iter_rows())
+    assert list(parallel.iter_rows(columns=["model"], skip=5, limit=10, asDict=False)) == \
+        list(sequential.iter_rows(columns=["model"], skip=5, limit=10, asDict=False))
+    assert parallel.statistics() == sequential.statistics()
+
+def test_split_csv_long_quoted_field(tmp_path):
+    path = str(tmp_path / "long.csv")
+    # no quotes near the guessed chunk ends, so they land inside the field
+    rows = [["id", "note"], ["0", "x\n" * 40000], ["1", "short"], ["2", "y\r\n" * 20000]]
+    _write(path, rows)
+    (header, chunks) = split_csv(path, chunkSize=1024)
+    assert header == ["id", "note"]
+    assert len(chunks) > 3
+    parsed = [row for chunk in parse_csv(path, maxWorkers=2, chunkSize=1024) for row in chunk]
+    assert parsed == rows[1:]
+
+def test_csv_quoted_crlf(tmp_path):
+    rows = [["id", "note", "value"]] + \
+        [[str(i), "a\r\nb", str(i) if i % 50 else "{}.5".format(i)] for i in range(300)]
+    path = str(tmp_path / "crlf.csv")
+    _write(path, rows)
+    def download(source):
+        with open(path, "rb") as f:
+            return f.read()
+    sequential = CSVData(LazyFile("http://example.com/crlf.csv", download))
+    parallel = CSVData(LazyFile("http://example.com/crlf.csv", download),
+                       maxWorkers=2, chunkSize=512)
+    assert list(sequential.iter_rows(asDict=False)) == [tuple(r) for r in rows[1:]]
+    assert list(parallel.iter_rows(asDict=False)) == [tuple(r) for r in rows[1:]]
+    # chunks inferring int and float are merged into one float column
+    assert parallel.columns["value"].dtype == columns.FLOAT
+    assert list(parallel.columns["value"].values) == list(sequential.columns["value"].values)
+    assert list(parallel.columns["note"].values) == ["a\r\nb"] * 300
@@ -0,0 +1,94 @@
+################################################################################
+# Copyright: Tobias Weber 2020
+#
+# Apache 2.0 License
+#
+# This file contains all rate-limit-related tests
+#
+################################################################################
+import time
+from unittest import mock
+
+from util import _MockResponse
+from rdp.services.ratelimit import AdaptiveConcurrency, RateLimiter, TokenBucket
+from rdp.services.retry import RetryPolicy
+from rdp.services.session import HttpSession
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=100, capacity=1)
+    start = time.monotonic()
+    for i in range(6):
+        bucket.acquire()
+    assert time.monotonic() - start >= 0.045
+    bucket.pause(0.05)
+    start = time.monotonic()
+    bucket.acquire()
+    assert time.monotonic() - start >= 0.045
+
+def test_adaptive_concurrency():
+    concurrency = AdaptiveConcurrency(initial=8, minimum=2, maximum=9)
+    concurrency.acquire()
+    concurrency.release(throttled=True)
+    assert concurrency.limit == 4
+    for i in range(4):
+        concurrency.acquire()
+        concurrency.release()
+    assert concurrency.limit == 5
+    for i in range(3):
+        concurrency.acquire()
+        concurrency.release(throttled=True)
+    assert concurrency.limit == 2
+
+def test_rate_limiter_retry_after():
+    responses = [
+        _MockResponse(b"", 429, {"Retry-After": "0.05"}),
+        _MockResponse(b"ok", 200, {"X-RateLimit-Remaining": "10"}),
+    ]
+    limiter = RateLimiter(rate=1000, concurrency=4)
+    session = HttpSession(rateLimiter=limiter)
+    with mock.patch('requests.Session.get', side_effect=responses) as mock_get:
+        start = time.monotonic()
+        r = session.get("https://zenodo.org/api/records")
+    assert r.status_code == 200
+    assert mock_get.call_count == 2
+    assert time.monotonic() - start >= 0.045
+    assert limiter.host("https://zenodo.org/oai2d").concurrency.limit == 2
+    assert limiter.host("https://example.com").concurrency.limit == 4
+
+def test_rate_limiter_gives_up():
+    limiter = RateLimiter(rate=1000, maxRetries=2, defaultBackoff=0)
+    session = HttpSession(rateLimiter=limiter)
+    with mock.patch('requests.Session.head', return_value=_MockResponse(b"", 429)) as mock_head:
+        assert session.head("https://zenodo.org/api/files/a").status_code == 429
+    assert mock_head.call_count == 3
+
+def test_rate_limiter_zoneless_retry_after():
+    limiter = RateLimiter(rate=1000, concurrency=2)
+    url = "https://zenodo.org/api/records"
+    for date in ("Wed, 21 Oct 2015 07:28:00", "Wed, 21 Oct 2015 07:28:00 -0000"):
+        limiter.acquire(url)
+        assert limiter.release(url, _MockResponse(b"", 503, {"Retry-After": date}))
+    concurrency = limiter.host(url).concurrency
+    assert concurrency.active == 0
+    # a header which cannot be handled does not leak the slot
+    limiter.acquire(url)
+    broken = _MockResponse(b"", 200, None)
+    broken.headers = mock.Mock(get=mock.Mock(side_effect=RuntimeError))
+    try:
+        limiter.release(url, broken)
+    except RuntimeError:
+        pass
+    assert concurrency.active == 0
+
+def test_rate_limiter_owns_throttled_retries():
+    limiter = RateLimiter(rate=1000, maxRetries=2, defaultBackoff=0)
+    session = HttpSession(rateLimiter=limiter, retryPolicy=RetryPolicy(retries=3, backoff=0.001))
+    throttled = _MockResponse(b"", 503, {"Retry-After": "0"})
+    with mock.patch('requests.Session.get', return_value=throttled) as mock_get:
+        assert session.get("https://zenodo.org/api/records").status_code == 503
+    # retried by the rate limiter only, not once more by the retry policy
+    assert mock_get.call_count == 3
+    with mock.patch('requests.Session.get', side_effect=[_MockResponse(b"", 503),
+                                                         _MockResponse(b"ok", 200)]) as mock_get:
+        assert session.get("https://zenodo.org/api/records").status_code == 200
+    assert mock_get.call_count == 2
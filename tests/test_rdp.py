@@ -9,19 +9,23 @@
 
 import os
 import re
+import time
 
 from unittest import mock
 import pytest
+import requests
 
 from rdp.metadata import Metadata, parseDateString
 from rdp.metadata.datacite import DataCiteMetadata
 from rdp.metadata.factory import MetadataFactory
 from rdp.data import CSVData
-from rdp.services import OaipmhService, ZenodoRestService, Service
+from rdp.services import OaipmhService, ZenodoRestService, Service, ServiceBundle
+from rdp.services.capacities import RetrieveData, RetrieveDataHttpHeaders, RetrieveMetadata
 from rdp import RdpFactory, Rdp
-from rdp.util import Bundle
+from rdp.util import Bundle, LazyFile
+from rdp.exceptions import CannotCreateMetadataException
 
-from util import mocked_requests_get
+from util import mocked_requests_get, mocked_requests_head, _MockResponse
 # Checks that all exceptions in metadata are thrown appropiately
 def test_metadata_exceptions():
     with pytest.raises(NotImplementedError):
@@ -93,14 +97,33 @@ def test_blank_metadata():
             assert str(nie) == "Must be implemented by subclasses of Metadata."
 
 # Checks implemented functionality of the oai-pmh service
-@mock.patch('requests.get', side_effect=mocked_requests_get)
+@mock.patch('requests.Session.get', side_effect=mocked_requests_get)
 def test_service_oaipmh(mock_get):
     oaipmh = OaipmhService("https://zenodo.org/oai2d", "oai:zenodo.org:")
     md = oaipmh.get_metadata("3490396", "datacite")
     assert md.pid == "10.5281/zenodo.3490396"
 
+@mock.patch('requests.Session.get', side_effect=mocked_requests_get)
+def test_service_oaipmh_list_records(mock_get):
+    oaipmh = OaipmhService("https://zenodo.org/oai2d", "oai:zenodo.org:")
+    records = list(oaipmh.list_records("datacite", setSpec="user-test"))
+    assert len(records) == 3
+    assert isinstance(records[0], DataCiteMetadata)
+    assert records[0].pid == "10.5281/zenodo.3490396"
+    assert records[2].pid == "10.5282/verba-alpina/A12317_v4"
+    assert mock_get.call_count == 2
+    assert list(oaipmh.list_records("datacite", setSpec="user-empty")) == []
+    with pytest.raises(CannotCreateMetadataException):
+        list(oaipmh.list_records("datacite", setSpec="unknown"))
+
+@mock.patch('requests.Session.get', side_effect=mocked_requests_get)
+def test_service_oaipmh_list_identifiers(mock_get):
+    oaipmh = OaipmhService("https://zenodo.org/oai2d", "oai:zenodo.org:")
+    identifiers = list(oaipmh.list_identifiers("datacite"))
+    assert identifiers == ["3490396", "goodex1"]
+
 # Checks implemented functionality of the rest-zenodo service
-@mock.patch('requests.get', side_effect=mocked_requests_get)
+@mock.patch('requests.Session.get', side_effect=mocked_requests_get)
 def test_service_rest_zenodo(mock_get):
     rest = ZenodoRestService("https://zenodo.org/api")
     data_bundle = Bundle()
@@ -112,7 +135,201 @@ def test_service_rest_zenodo(mock_get):
     assert first.encoding is None
     assert re.search(r"introduction", first.text, re.IGNORECASE)
     assert first.numPages == 11
-
+    assert first.digest == "md5:037c8d56988886e7209f45abe0855a9a"
+
+class _BrokenResponse(_MockResponse):
+    def iter_content(self, chunk_size=1):
+        yield self.content[:1000]
+        raise requests.exceptions.ConnectionError("connection reset")
+
+@mock.patch('requests.Session.get')
+def test_service_rest_zenodo_resume_errors(mock_get):
+    content = bytes(range(256)) * 12
+    mock_get.side_effect = [
+        _BrokenResponse(content, 200),
+        _MockResponse(b"Service Unavailable", 503),
+        _MockResponse(content[1000:], 206),
+    ]
+    rest = ZenodoRestService("https://zenodo.org/api")
+    lf = LazyFile("https://zenodo.org/api/files/x/a.bin", rest.stream, size=len(content),
+                  resumable=True)
+    with open(lf.loc, "rb") as f:
+        assert f.read() == content
+    assert mock_get.call_args[1]["headers"] == {"Range": "bytes=1000-"}
+    lf.remove()
+    # error pages are never stored as file content
+    mock_get.side_effect = [_MockResponse(b"Not Found", 404)]
+    lf = LazyFile("https://zenodo.org/api/files/x/b.bin", rest.stream)
+    with pytest.raises(requests.exceptions.HTTPError):
+        lf.loc
+    # a complete partial file is answered with 416
+    mock_get.side_effect = [_MockResponse(b"", 416, {"Content-Range": "bytes */3072"})]
+    assert list(rest.stream("https://zenodo.org/api/files/x/a.bin", 3072)) == []
+
+@mock.patch('requests.Session.get', side_effect=mocked_requests_get)
+def test_service_rest_zenodo_lazy_pdf(mock_get):
+    rest = ZenodoRestService("https://zenodo.org/api")
+    data = list(rest.get_data("3490396"))
+    assert len(data) == 1
+    assert all("/records/" in c[0][0] for c in mock_get.call_args_list)
+    assert data[0].numPages == 11
+    assert not all("/records/" in c[0][0] for c in mock_get.call_args_list)
+
+@mock.patch('requests.Session.get', side_effect=mocked_requests_get)
+def test_service_rest_zenodo_stream(mock_get):
+    rest = ZenodoRestService("https://zenodo.org/api", chunkSize=1000)
+    source = "https://zenodo.org/api/files/7c4aaea9-0290-47ab-90e6-f5570ddcc0a8/md001.pdf"
+    chunks = list(rest.stream(source))
+    assert max(len(c) for c in chunks) == 1000
+    assert b"".join(chunks) == rest.download(source)
+
+
+@mock.patch('requests.Session.get', side_effect=mocked_requests_get)
+def test_service_rest_zenodo_range(mock_get):
+    rest = ZenodoRestService("https://zenodo.org/api", chunkSize=1000)
+    source = "https://zenodo.org/api/files/7c4aaea9-0290-47ab-90e6-f5570ddcc0a8/md001.pdf"
+    content = rest.download(source)
+    # server ignoring the Range header
+    assert b"".join(rest.stream(source, 2500)) == content[2500:]
+    assert mock_get.call_args[1]["headers"] == {"Range": "bytes=2500-"}
+    # server honouring the Range header
+    mock_get.side_effect = lambda *args, **kwargs: _MockResponse(content[2500:], 206)
+    assert b"".join(rest.stream(source, 2500)) == content[2500:]
+
+@mock.patch('requests.Session.head', side_effect=mocked_requests_head)
+@mock.patch('requests.Session.get', side_effect=mocked_requests_get)
+def test_service_rest_zenodo_record_cache(mock_get, mock_head):
+    rest = ZenodoRestService("https://zenodo.org/api")
+    data = list(rest.get_data("3490396"))
+    headers = list(rest.get_headers("3490396"))
+    assert len(data) == len(headers) == 1
+    lookups = [c for c in mock_get.call_args_list if "/records/" in c[0][0]]
+    assert len(lookups) == 1
+    assert rest.recordCache.misses == 1
+    assert rest.recordCache.hits == 1
+
+@mock.patch('requests.Session.head', side_effect=mocked_requests_head)
+def test_service_rest_zenodo_concurrent_headers(mock_head):
+    rest = ZenodoRestService("https://zenodo.org/api")
+    sources = [
+        "http://creativecommons.org/licenses/by/4.0/legalcode",
+        "https://somethingwentterriblywrong.com",
+        "https://doi.org/10.5281/zenodo.3490396",
+    ] * 5
+    rest.recordCache.put("many", {"files": [{"links": {"self": s}} for s in sources]})
+    headers = list(rest.get_headers("many", maxWorkers=4))
+    assert len(headers) == 15
+    assert isinstance(headers[1], Exception)
+    assert headers[2]["Location"] == "https://zenodo.org/record/3490396"
+    completed = list(rest.get_headers_as_completed("many", maxWorkers=4))
+    assert sorted(c[0] for c in completed) == sorted(sources)
+    assert all(isinstance(c[1], Exception) == (c[0] == sources[1]) for c in completed)
+
+class _FakeService(Service):
+    def __init__(self, name, fail=False, delay=0):
+        Service.__init__(self, "http://www.example.com/{}".format(name))
+        self.name = name
+        self.fail = fail
+        self.delay = delay
+        self.calls = 0
+        self.serviceCapacities.append(RetrieveMetadata)
+        self.serviceCapacities.append(RetrieveData)
+
+    def get_metadata(self, identifier, scheme):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.fail:
+            raise CannotCreateMetadataException(self.name)
+        return self.name
+
+    def get_data(self, identifier):
+        if self.fail:
+            raise ValueError(self.name)
+        yield self.name
+
+def test_service_bundle_routing():
+    bundle = ServiceBundle()
+    bundle.put("a", _FakeService("a"), priority=5)
+    bundle.put("b", _FakeService("b"), priority=1)
+    bundle.put("c", _FakeService("c"), priority=1)
+    assert [s.name for s in bundle.services_for(RetrieveMetadata)] == ["b", "c", "a"]
+    assert bundle.get_metadata("x", "datacite") == "b"
+    bundle.put("b", _FakeService("b", fail=True), priority=1)
+    assert [s.name for s in bundle.services_for(RetrieveData)] == ["c", "b", "a"]
+    bundle.put("c", _FakeService("c", fail=True), priority=0)
+    assert bundle.get_metadata("x", "datacite") == "a"
+    assert list(bundle.get_data("x")) == ["a"]
+    assert bundle.services_for(RetrieveDataHttpHeaders) == []
+    bundle.put("a", _FakeService("a", fail=True))
+    with pytest.raises(CannotCreateMetadataException):
+        bundle.get_metadata("x", "datacite")
+
+def test_service_bundle_hedging():
+    bundle = ServiceBundle(hedgeDelay=0.05)
+    bundle.put("slow", _FakeService("slow", delay=0.5), priority=0)
+    bundle.put("fast", _FakeService("fast", delay=0.01), priority=1)
+    start = time.monotonic()
+    assert bundle.get_metadata("x", "datacite") == "fast"
+    assert time.monotonic() - start < 0.3
+    # no backup request if the preferred service answers in time
+    bundle = ServiceBundle(hedgeDelay=0.2)
+    bundle.put("a", _FakeService("a", delay=0.01), priority=0)
+    bundle.put("b", _FakeService("b"), priority=1)
+    assert bundle.get_metadata("x", "datacite") == "a"
+    assert bundle.get("b").calls == 0
+    # failures fall through immediately
+    bundle = ServiceBundle(hedgeDelay=10)
+    bundle.put("a", _FakeService("a", fail=True), priority=0)
+    bundle.put("b", _FakeService("b"), priority=1)
+    assert bundle.get_metadata("x", "datacite") == "b"
+    bundle.put("b", _FakeService("b", fail=True), priority=1)
+    with pytest.raises(CannotCreateMetadataException):
+        bundle.get_metadata("x", "datacite")
+
+def mocked_zenodo_search(*args, **kwargs):
+    params = kwargs.get("params") or {}
+    ids = [i for i in params["q"][len("recid:("):-1].split(" OR ") if i != "404"]
+    page = ids[(params["page"] - 1) * params["size"]:params["page"] * params["size"]]
+    hits = [{"id": int(i), "files": [{"links": {"self": "https://zenodo.org/api/files/{}.csv".format(i)}}]}
+            for i in page]
+    return _MockResponse({"hits": {"hits": hits, "total": len(ids)}}, 200)
+
+@mock.patch('requests.Session.get', side_effect=mocked_zenodo_search)
+def test_service_rest_zenodo_resolve_records(mock_get):
+    rest = ZenodoRestService("https://zenodo.org/api")
+    ids = [str(i) for i in range(100, 107)] + ["404"]
+    records = rest.resolve_records(ids, batchSize=4, pageSize=3)
+    assert sorted(records.keys()) == ids[:-1]
+    # two batches: 4 ids on 2 pages, 3 ids (+ an unknown one) on 1 page
+    assert mock_get.call_count == 3
+    assert mock_get.call_args_list[0][1]["params"]["q"] == "recid:(100 OR 101 OR 102 OR 103)"
+    data = list(rest.get_data("105"))
+    assert data[0].file.source == "https://zenodo.org/api/files/105.csv"
+    assert mock_get.call_count == 3
+    rest.resolve_records(ids[:3])
+    assert mock_get.call_count == 3
+
+def mocked_capped_search(*args, **kwargs):
+    # the server returns at most 2 hits per page, whatever size is requested
+    params = dict(kwargs.get("params") or {})
+    params["size"] = min(params["size"], 2)
+    return mocked_zenodo_search(*args, params=params)
+
+@mock.patch('requests.Session.get', side_effect=mocked_capped_search)
+def test_service_rest_zenodo_resolve_records_capped(mock_get):
+    rest = ZenodoRestService("https://zenodo.org/api")
+    ids = [str(i) for i in range(100, 107)]
+    records = rest.resolve_records(ids, batchSize=4, pageSize=3)
+    assert sorted(records.keys()) == ids
+    assert mock_get.call_count == 4
+
+@mock.patch('requests.Session.get', side_effect=mocked_zenodo_search)
+def test_rdp_factory_create_all(mock_get):
+    rdps = RdpFactory.create_all(["10.5281/zenodo.{}".format(i) for i in range(10)], "zenodo")
+    assert mock_get.call_count == 1
+    assert rdps[3].services.session is rdps[4].services.session
+    assert len(rdps[7].data) == 1
+    assert mock_get.call_count == 1
 
 # Checks the functionality of an unspecified RDP
 def test_rdp_unspecified():
@@ -120,13 +337,13 @@ def test_rdp_unspecified():
     assert type(rdp) == Rdp
 
 # Checks the functionality of a zenodo RDP
-@mock.patch('requests.get', side_effect=mocked_requests_get)
+@mock.patch('requests.Session.get', side_effect=mocked_requests_get)
 def test_rdp_zenodo_pid(mock_get):
     rdp = RdpFactory.create("10.5281/zenodo.3490396", "zenodo")
     assert rdp.pid == "10.5281/zenodo.3490396"
     assert rdp.metadata.pid == "10.5281/zenodo.3490396"
 
-@mock.patch('requests.get', side_effect=mocked_requests_get)
+@mock.patch('requests.Session.get', side_effect=mocked_requests_get)
 def test_rdp_zenodo_description(mock_get):
     rdp = RdpFactory.create("10.5281/zenodo.3490396", "zenodo")
     assert len(rdp.metadata.descriptions) > 0
@@ -139,7 +356,7 @@ def test_rdp_zenodo_description(mock_get):
     rdp = RdpFactory.create("10.5281/zenodo.badex4", "zenodo")
     assert len(rdp.metadata.descriptions) == 1
 
-@mock.patch('requests.get', side_effect=mocked_requests_get)
+@mock.patch('requests.Session.get', side_effect=mocked_requests_get)
 def test_rdp_zenodo_title(mock_get):
     rdp = RdpFactory.create("10.5281/zenodo.3490396", "zenodo")
     assert len(rdp.metadata.titles) == 2
@@ -181,7 +398,7 @@ def test_rdp_zenodo_title(mock_get):
     assert rdp.metadata.titles[1].text == "Und einer mit einem Parameter"
     assert rdp.metadata.titles[1].type == "TranslatedTitle"
 
-@mock.patch('requests.get', side_effect=mocked_requests_get)
+@mock.patch('requests.Session.get', side_effect=mocked_requests_get)
 def test_rdp_zenodo_formats(mock_get):
     rdp = RdpFactory.create("10.5281/zenodo.3490396", "zenodo")
     assert len(rdp.metadata.formats) == 2
@@ -195,7 +412,7 @@ def test_rdp_zenodo_formats(mock_get):
     assert len(rdp.metadata.formats) == 1
     assert rdp.metadata.formats[0] == "application/json"
 
-@mock.patch('requests.get', side_effect=mocked_requests_get)
+@mock.patch('requests.Session.get', side_effect=mocked_requests_get)
 def test_rdp_zenodo_rights(mock_get):
     rdp = RdpFactory.create("10.5281/zenodo.3490396", "zenodo")
     assert rdp.metadata.rights[0].text == "Creative Commons Attribution 4.0 International"
@@ -215,7 +432,7 @@ def test_rdp_zenodo_rights(mock_get):
     assert rdp.metadata.rights[1].spdx == None
     assert len(rdp.metadata.rights) == 3
 
-@mock.patch('requests.get', side_effect=mocked_requests_get)
+@mock.patch('requests.Session.get', side_effect=mocked_requests_get)
 def test_rdp_zenodo_subjects(mock_get):
     rdp = RdpFactory.create("10.5281/zenodo.3490396", "zenodo")
     assert len(rdp.metadata.subjects) == 2
@@ -236,7 +453,7 @@ def test_rdp_zenodo_subjects(mock_get):
     assert len(rdp.metadata.subjects) == 15
     assert rdp.metadata.subjects[3].valueURI == "https://www.wikidata.org/wiki/Q846047"
 
-@mock.patch('requests.get', side_effect=mocked_requests_get)
+@mock.patch('requests.Session.get', side_effect=mocked_requests_get)
 def test_rdp_zenodo_creators(mock_get):
     rdp = RdpFactory.create("10.5281/zenodo.3490396", "zenodo")
     assert len(rdp.metadata.creators) == 2
@@ -262,7 +479,7 @@ def test_rdp_zenodo_creators(mock_get):
     rdp = RdpFactory.create("10.5281/zenodo.badex3", "zenodo")
     assert rdp.metadata.creators[1].name == "Leibniz Rechenzentrum"
 
-@mock.patch('requests.get', side_effect=mocked_requests_get)
+@mock.patch('requests.Session.get', side_effect=mocked_requests_get)
 def test_rdp_zenodo_size(mock_get):
     rdp = RdpFactory.create("10.5281/zenodo.3490396", "zenodo")
     assert rdp.metadata.sizes[0] == "12000kb"
@@ -275,7 +492,7 @@ def test_rdp_zenodo_size(mock_get):
     assert rdp.metadata.sizes[0] == "120 records"
     assert rdp.metadata.sizes[1] == "12 GB"
 
-@mock.patch('requests.get', side_effect=mocked_requests_get)
+@mock.patch('requests.Session.get', side_effect=mocked_requests_get)
 def test_rdp_zenodo_version(mock_get):
     rdp = RdpFactory.create("10.5281/zenodo.3490396", "zenodo")
     assert rdp.metadata.version == "1.0.0"
@@ -283,7 +500,7 @@ def test_rdp_zenodo_version(mock_get):
     rdp = RdpFactory.create("10.5281/zenodo.badex1", "zenodo")
     assert rdp.metadata.version is None
 
-@mock.patch('requests.get', side_effect=mocked_requests_get)
+@mock.patch('requests.Session.get', side_effect=mocked_requests_get)
 def test_rdp_zenodo_language(mock_get):
     rdp = RdpFactory.create("10.5281/zenodo.3490396", "zenodo")
     assert rdp.metadata.language == "en"
@@ -294,7 +511,7 @@ def test_rdp_zenodo_language(mock_get):
     rdp = RdpFactory.create("10.5281/zenodo.badex2", "zenodo")
     assert rdp.metadata.language == "English"
 
-@mock.patch('requests.get', side_effect=mocked_requests_get)
+@mock.patch('requests.Session.get', side_effect=mocked_requests_get)
 def test_rdp_zenodo_contributors(mock_get):
     rdp = RdpFactory.create("10.5281/zenodo.3490396", "zenodo")
     assert len(rdp.metadata.contributors) == 2
@@ -317,7 +534,7 @@ def test_rdp_zenodo_contributors(mock_get):
     assert rdp.metadata.contributors[0].type == "RightsHolder"
     assert rdp.metadata.contributors[1].type == "HostingInstitution"
 
-@mock.patch('requests.get', side_effect=mocked_requests_get)
+@mock.patch('requests.Session.get', side_effect=mocked_requests_get)
 def test_rdp_zenodo_publicationYear(mock_get):
     rdp = RdpFactory.create("10.5281/zenodo.3490396", "zenodo")
     assert rdp.metadata.publicationYear == 2019
@@ -325,7 +542,7 @@ def test_rdp_zenodo_publicationYear(mock_get):
     rdp = RdpFactory.create("10.5281/zenodo.badex1", "zenodo")
     assert rdp.metadata.publicationYear == None
 
-@mock.patch('requests.get', side_effect=mocked_requests_get)
+@mock.patch('requests.Session.get', side_effect=mocked_requests_get)
 def test_rdp_zenodo_dates(mock_get):
     rdp = RdpFactory.create("10.5281/zenodo.3490396", "zenodo")
     assert len(rdp.metadata.dates) == 2
@@ -371,7 +588,7 @@ def test_rdp_zenodo_dates(mock_get):
     assert rdp.metadata.dates[1].type == "Updated"
     assert rdp.metadata.dates[1].information is None
 
-@mock.patch('requests.get', side_effect=mocked_requests_get)
+@mock.patch('requests.Session.get', side_effect=mocked_requests_get)
 def test_rdp_type(mock_get):
     rdp = RdpFactory.create("10.5281/zenodo.3490396", "zenodo")
     assert rdp.metadata.type == "Dataset"
@@ -385,7 +602,7 @@ def test_rdp_type(mock_get):
     rdp = RdpFactory.create("10.5281/zenodo.badex3", "zenodo")
     assert rdp.metadata.type == "Text"
 
-@mock.patch('requests.get', side_effect=mocked_requests_get)
+@mock.patch('requests.Session.get', side_effect=mocked_requests_get)
 def test_rdp_related_resources(mock_get):
     rdp = RdpFactory.create("10.5281/zenodo.3490396", "zenodo")
     assert len(rdp.metadata.relatedResources) == 2
@@ -418,7 +635,17 @@ def test_rdp_related_resources(mock_get):
     rdp = RdpFactory.create("10.5281/zenodo.badex5", "zenodo")
     assert len(rdp.metadata.relatedResources) == 1
 
-@mock.patch('requests.get', side_effect=mocked_requests_get)
+@mock.patch('requests.Session.get', side_effect=mocked_requests_get)
+def test_rdp_zenodo_iter_data(mock_get):
+    rdp = RdpFactory.create("10.5281/zenodo.3490396", "zenodo")
+    data = list(rdp.iter_data(window=2))
+    assert len(data) == 1
+    # waits for the background download (PDFData itself downloads nothing)
+    assert os.path.exists(data[0].file.loc)
+    assert data[0].file.digest == "md5:037c8d56988886e7209f45abe0855a9a"
+    assert [d.file.source for d in rdp.iter_data()] == [d.file.source for d in data]
+
+@mock.patch('requests.Session.get', side_effect=mocked_requests_get)
 def test_rdp_zenodo_services(mock_get):
     rdp = RdpFactory.create("10.5281/zenodo.3490396", "zenodo")
     assert len(rdp.services) == 2
@@ -430,12 +657,12 @@ def test_rdp_zenodo_services(mock_get):
         if idx == 1:
             assert service_name == services[0]
 
-@mock.patch('requests.get', side_effect=mocked_requests_get)
+@mock.patch('requests.Session.get', side_effect=mocked_requests_get)
 def test_rdp_zenodo_data(mock_get):
     rdp = RdpFactory.create("10.5281/zenodo.3490396", "zenodo")
     assert len(rdp.data) == 2
 
-@mock.patch('requests.get', side_effect=mocked_requests_get)
+@mock.patch('requests.Session.get', side_effect=mocked_requests_get)
 def test_rdp_zenodo_data(mock_get):
     rdp = RdpFactory.create("10.5281/zenodo.3490396", "zenodo")
     assert len(rdp.data) == 1
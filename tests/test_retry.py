@@ -0,0 +1,69 @@
+################################################################################
+# Copyright: Tobias Weber 2020
+#
+# Apache 2.0 License
+#
+# This file contains all retry-related tests
+#
+################################################################################
+import time
+from unittest import mock
+import pytest
+import requests
+
+from util import _MockResponse
+from rdp.exceptions import CircuitOpenException
+from rdp.services.retry import CircuitBreaker, RetryPolicy
+from rdp.services.session import HttpSession
+
+def test_retry_policy_delay():
+    policy = RetryPolicy(backoff=1, maxBackoff=5, jitter=False)
+    assert [policy.delay(a) for a in range(4)] == [1, 2, 4, 5]
+    policy = RetryPolicy(backoff=1, maxBackoff=5)
+    assert all(0 <= policy.delay(3) <= 5 for i in range(20))
+
+def test_retry_transient_errors():
+    responses = [
+        _MockResponse(b"", 502),
+        requests.exceptions.ConnectionError("reset"),
+        _MockResponse(b"ok", 200),
+    ]
+    session = HttpSession(retryPolicy=RetryPolicy(retries=3, backoff=0.001))
+    with mock.patch('requests.Session.get', side_effect=responses) as mock_get:
+        assert session.get("https://zenodo.org/oai2d").status_code == 200
+    assert mock_get.call_count == 3
+    with mock.patch('requests.Session.get', return_value=_MockResponse(b"", 404)) as mock_get:
+        assert session.get("https://zenodo.org/oai2d").status_code == 404
+    assert mock_get.call_count == 1
+    with mock.patch('requests.Session.get', side_effect=requests.exceptions.Timeout("slow")):
+        with pytest.raises(requests.exceptions.Timeout):
+            session.get("https://zenodo.org/oai2d")
+
+def test_circuit_breaker():
+    breaker = CircuitBreaker(failureThreshold=2, resetTimeout=0.05)
+    session = HttpSession(circuitBreaker=breaker)
+    with mock.patch('requests.Session.get', return_value=_MockResponse(b"", 503)) as mock_get:
+        session.get("https://zenodo.org/oai2d")
+        session.get("https://zenodo.org/oai2d")
+        assert breaker.state("https://zenodo.org/oai2d?verb=ListRecords") == CircuitBreaker.OPEN
+        with pytest.raises(CircuitOpenException):
+            session.get("https://zenodo.org/oai2d")
+        assert mock_get.call_count == 2
+        # other endpoints of the same host are not affected
+        assert breaker.state("https://zenodo.org/api/records") == CircuitBreaker.CLOSED
+        session.get("https://zenodo.org/api/records")
+        assert mock_get.call_count == 3
+        time.sleep(0.06)
+        # failing probe opens the circuit again
+        session.get("https://zenodo.org/oai2d")
+        assert breaker.state("https://zenodo.org/oai2d") == CircuitBreaker.OPEN
+    time.sleep(0.06)
+    with mock.patch('requests.Session.get', return_value=_MockResponse(b"", 200)):
+        assert session.get("https://zenodo.org/oai2d").status_code == 200
+    assert breaker.state("https://zenodo.org/oai2d") == CircuitBreaker.CLOSED
+
+def test_circuit_breaker_key():
+    breaker = CircuitBreaker(failureThreshold=1, key=lambda url: "all")
+    breaker.record("https://zenodo.org/oai2d", False)
+    with pytest.raises(CircuitOpenException):
+        breaker.before("https://example.com/api")
@@ -0,0 +1,56 @@
+################################################################################
+# Copyright: Tobias Weber 2020
+#
+# Apache 2.0 License
+#
+# This file contains all session-related tests
+#
+################################################################################
+from unittest import mock
+import requests
+
+from util import mocked_requests_get
+from rdp import RdpFactory
+from rdp.services import ServiceBundle, OaipmhService, ZenodoRestService
+from rdp.services.session import HttpSession
+
+def test_session_pool():
+    session = HttpSession(poolConnections=2, poolSize=7)
+    adapter = session.session.get_adapter("https://zenodo.org")
+    assert adapter._pool_connections == 2
+    assert adapter._pool_maxsize == 7
+    assert session.session.headers.get("Connection") != "close"
+    session = HttpSession(keepAlive=False)
+    assert session.session.headers["Connection"] == "close"
+
+def test_session_custom():
+    custom = requests.Session()
+    session = HttpSession(session=custom)
+    assert session.session is custom
+
+def test_session_shared_by_bundle():
+    session = HttpSession()
+    bundle = ServiceBundle(session=session)
+    bundle.put("oai-pmh", OaipmhService("https://zenodo.org/oai2d"))
+    bundle.put("zenodo-rest-api", ZenodoRestService("https://zenodo.org/api"))
+    for key, service in bundle.items():
+        assert service.session is session
+
+def test_session_lazy_and_kept():
+    service = ZenodoRestService("https://zenodo.org/api")
+    assert not service.has_session()
+    own = HttpSession()
+    bundle = ServiceBundle(session=HttpSession())
+    bundle.put("oai-pmh", OaipmhService("https://zenodo.org/oai2d", session=own))
+    bundle.put("zenodo-rest-api", service)
+    assert bundle.get("oai-pmh").session is own
+    assert service.session is bundle.session
+
+@mock.patch('requests.Session.get', side_effect=mocked_requests_get)
+def test_session_shared_by_rdps(mock_get):
+    session = HttpSession()
+    rdp1 = RdpFactory.create("10.5281/zenodo.3490396", "zenodo", session=session)
+    rdp2 = RdpFactory.create("10.5281/zenodo.badex1", "zenodo", session=session)
+    assert rdp1.services.get("oai-pmh").session is session
+    assert rdp2.services.get("zenodo-rest-api").session is session
+    assert rdp1.metadata.pid == "10.5281/zenodo.3490396"
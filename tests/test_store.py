@@ -0,0 +1,64 @@
+################################################################################
+# Copyright: Tobias Weber 2020
+#
+# Apache 2.0 License
+#
+# This file contains all store-related tests
+#
+################################################################################
+import hashlib
+import os
+
+from rdp.util import LazyFile
+from rdp.util.store import BlobStore
+
+def _lazyfile(store, content, calls, source="http://example.com/a.bin"):
+    def download(source):
+        calls.append(source)
+        return content
+    checksum = "md5:{}".format(hashlib.md5(content).hexdigest())
+    return LazyFile(source, download, checksum=checksum, store=store)
+
+def test_store_shares_files(tmp_path):
+    store = BlobStore(str(tmp_path))
+    calls = []
+    first = _lazyfile(store, b"abc", calls)
+    second = _lazyfile(store, b"abc", calls, "http://mirror.example.com/a.bin")
+    assert first.loc == second.loc
+    assert calls == ["http://example.com/a.bin"]
+    assert second.digest == first.digest
+    first.remove()
+    assert os.path.exists(second.loc)
+    # a later run (new store object, same directory) finds the file
+    third = _lazyfile(BlobStore(str(tmp_path)), b"abc", calls)
+    assert third.loc == second.loc
+    assert len(calls) == 1
+
+def test_store_evicts_unreferenced(tmp_path):
+    store = BlobStore(str(tmp_path), maxSize=25)
+    calls = []
+    files = [_lazyfile(store, bytes([i]) * 10, calls) for i in range(3)]
+    files[0].loc
+    files[1].loc
+    files[0].remove()
+    files[2].loc
+    assert not os.path.exists(store.path(store.key(None, files[0].checksum)))
+    assert os.path.exists(files[1].loc)
+    assert store.size() == 20
+    # referenced files are kept even if the quota is exceeded
+    files[0].loc
+    assert store.size() == 30
+
+def test_store_stale_references(tmp_path):
+    store = BlobStore(str(tmp_path), maxSize=5)
+    def fetch(directory):
+        path = os.path.join(directory, "partial")
+        with open(path, "wb") as f:
+            f.write(b"x" * 10)
+        return path
+    (path, reference) = store.acquire("md5-x", fetch)
+    assert os.path.exists(path)
+    # reference of a process which ended without releasing it
+    os.rename(reference, os.path.join(str(tmp_path), "refs", "md5-x.999999999.dead"))
+    store._evict()
+    assert not os.path.exists(path)
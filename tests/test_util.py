@@ -0,0 +1,160 @@
+################################################################################
+# Copyright: Tobias Weber 2020
+#
+# Apache 2.0 License
+#
+# This file contains all util-related tests
+#
+################################################################################
+import hashlib
+import os
+import time
+import pytest
+
+from rdp.util import LazyFile, LRUCache, prefetch
+
+def test_lazyfile_bytes():
+    lf = LazyFile("http://example.com/a.txt", lambda source: b"abc")
+    with open(lf.loc, "rb") as f:
+        assert f.read() == b"abc"
+    loc = lf.loc
+    lf.remove()
+    assert not os.path.exists(loc)
+
+def test_lazyfile_chunks():
+    def chunks(source):
+        for i in range(10):
+            yield bytes([i]) * 1000
+    lf = LazyFile("http://example.com/b.bin", chunks)
+    assert os.path.getsize(lf.loc) == 10000
+    with open(lf.loc, "rb") as f:
+        f.seek(9999)
+        assert f.read() == bytes([9])
+
+def test_lrucache():
+    cache = LRUCache(maxSize=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert "a" in cache and "c" in cache
+    assert cache.hits == 1
+    assert cache.misses == 1
+    cache = LRUCache(ttl=0.01)
+    cache.put("a", 1)
+    time.sleep(0.02)
+    assert cache.get("a", "expired") == "expired"
+    assert len(cache) == 0
+
+def test_lazyfile_resume():
+    content = bytes(range(256)) * 40
+    offsets = []
+    def flaky(source, offset=0):
+        offsets.append(offset)
+        yield content[offset:offset + 1000]
+        if offset + 1000 < len(content):
+            raise ConnectionError("connection reset")
+    lf = LazyFile("http://example.com/c.bin", flaky, size=len(content),
+                  resumable=True, resumeAttempts=10)
+    with open(lf.loc, "rb") as f:
+        assert f.read() == content
+    assert offsets == [0, 1000, 2000, 3000, 4000, 5000, 6000, 7000, 8000, 9000, 10000]
+
+def test_lazyfile_partial_kept():
+    content = b"x" * 3000
+    def flaky(source, offset=0):
+        yield content[offset:offset + 1000]
+        if offset + 1000 < len(content):
+            raise ConnectionError("connection reset")
+    lf = LazyFile("http://example.com/d.bin", flaky, size=3000,
+                  resumable=True, resumeAttempts=0)
+    for i in range(2):
+        with pytest.raises(ConnectionError):
+            lf.download()
+    assert os.path.getsize(lf._partial) == 2000
+    assert lf._loc is None
+    lf.download()
+    assert os.path.getsize(lf.loc) == 3000
+
+def test_lazyfile_size_mismatch():
+    lf = LazyFile("http://example.com/e.bin", lambda source: b"abc", size=4)
+    with pytest.raises(IOError):
+        lf.loc
+
+def test_lazyfile_checksum():
+    content = b"abc" * 1000
+    def chunks(source, offset=0):
+        for i in range(offset, len(content), 100):
+            yield content[i:i + 100]
+    checksum = "md5:{}".format(hashlib.md5(content).hexdigest())
+    lf = LazyFile("http://example.com/f.bin", chunks, checksum=checksum)
+    assert lf.digest is None
+    lf.loc
+    assert lf.digest == checksum
+    lf = LazyFile("http://example.com/g.bin", chunks, checksum="md5:0123")
+    with pytest.raises(IOError):
+        lf.loc
+    assert lf.digest is None
+    assert lf._partial is None
+
+class _Item(object):
+    def __init__(self, idx, size):
+        self.file = LazyFile("http://example.com/{}.bin".format(idx), self.download, size=size)
+        self.started = None
+
+    def download(self, source):
+        self.started = time.monotonic()
+        time.sleep(0.02)
+        return b"x" * self.file.size
+
+def test_prefetch():
+    items = [_Item(i, 10) for i in range(6)]
+    for (idx, item) in enumerate(prefetch(items, window=2, maxWorkers=2)):
+        if idx + 2 < len(items):
+            time.sleep(0.05)
+            assert items[idx + 2].started is not None
+            assert items[idx + 2].file._loc is not None
+        assert os.path.getsize(item.file.loc) == 10
+    items = [_Item(i, 10) for i in range(6)]
+    for (idx, item) in enumerate(prefetch(items, window=4, maxBytes=25)):
+        time.sleep(0.05)
+        if idx == 0:
+            assert items[1].started is not None
+            assert items[2].started is None
+        item.file.loc
+
+def test_prefetch_in_memory():
+    items = [_Item(i, 10) for i in range(3)]
+    for item in items:
+        item.file.memoryThreshold = 100
+    for item in prefetch(items, window=2):
+        with item.file.open() as f:
+            assert f.read() == b"x" * 10
+    assert all(item.file.inMemory and item.file._loc is None for item in items)
+
+def test_lazyfile_in_memory():
+    lf = LazyFile("http://example.com/h.txt", lambda source: [b"ab", b"cd"], memoryThreshold=10)
+    with lf.open() as f:
+        assert f.read() == b"abcd"
+    assert lf.inMemory
+    assert lf._loc is None
+    with open(lf.loc, "rb") as f:
+        assert f.read() == b"abcd"
+    loc = lf.loc
+    lf.remove()
+    assert not os.path.exists(loc)
+    assert not lf.inMemory
+
+def test_lazyfile_spill():
+    content = b"x" * 100
+    def chunks(source):
+        for i in range(0, len(content), 10):
+            yield content[i:i + 10]
+    checksum = "md5:{}".format(hashlib.md5(content).hexdigest())
+    lf = LazyFile("http://example.com/i.bin", chunks, checksum=checksum, memoryThreshold=50)
+    with lf.open() as f:
+        assert f.read() == content
+    assert not lf.inMemory
+    assert os.path.getsize(lf.loc) == 100
+    assert lf.digest == checksum
@@ -18,13 +18,43 @@ class _MockResponse:
         self.content = content
         self.status_code = status_code
         self.headers = headers
+        self.url = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
 
     def json(self):
         return self.content
 
+    def iter_content(self, chunk_size=1):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i+chunk_size]
+
+    def close(self):
+        pass
+
 # Prepare Mock responses for the tests
 def mocked_requests_get(*args, **kwargs):
     print(args[0])
+    if len(args) < 2:
+        args = (args[0], kwargs.get("params") or {})
+    if args[0] == "https://zenodo.org/oai2d" and args[1].get("verb") in ("ListRecords", "ListIdentifiers"):
+        artefacts = {
+            ("ListRecords", "user-test"): "oailist001",
+            ("ListRecords", "token001"): "oailist002",
+            ("ListIdentifiers", None): "oailist003",
+            ("ListRecords", "user-empty"): "oailist004",
+            ("ListRecords", "expired"): "oailist005",
+        }
+        key = (args[1]["verb"], args[1].get("resumptionToken", args[1].get("set")))
+        if key not in artefacts:
+            return _MockResponse(None, 404)
+        with open("./tests/artefacts/{}.xml".format(artefacts[key]), "rb") as f:
+            content = f.read()
+        return _MockResponse(content, 200)
     if args[0] == "https://zenodo.org/oai2d" and args[1]["identifier"] == "oai:zenodo.org:3490396":
         with open("./tests/artefacts/md001.xml", "rb") as f:
             content = f.read()